@@ -1,51 +1,268 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash, g
-from werkzeug.security import generate_password_hash, check_password_hash
+from flask import Flask, render_template, request, redirect, url_for, session, flash, g, Response, stream_with_context, make_response
 import sqlite3
 from pathlib import Path
 import requests
 from datetime import datetime
-from math import ceil, log2
+import time
+import json
+import hmac
+from math import ceil
+from functools import wraps
 import os
 from dotenv import load_dotenv
+from player_cache import PlayerCache, PlayerNotFound
+from cr_api import client_from_env
+from database import ConnectionPool
+from chat_stream import ChatBroadcaster
+from rate_limit import Policy, RateLimiter
+from bracket import generate_bracket, report_result, bracket_view, end_tournament
+from fragment_cache import FragmentCache
+from markupsafe import Markup
+from data_versions import Coherence, bump, get_versions, make_etag
+from snapshots import SnapshotRefresher, get_snapshot, save_snapshot
+from static_assets import StaticAssets
+from pfp_manifest import PfpManifest
+from passwords import PasswordServiceBusy, service_from_env
+import metrics
+from query_profiler import ProfiledConnection, QueryProfiler
+import search
+import jobs
+import battles
+from itsdangerous import BadSignature, SignatureExpired, URLSafeTimedSerializer
 
 BASE_DIR = Path(__file__).parent
 load_dotenv(BASE_DIR / ".env")
-DATABASE = BASE_DIR / "users.db"
+DATABASE = Path(os.getenv("DATABASE_PATH", BASE_DIR / "users.db"))
 app = Flask(__name__)
 app.secret_key = os.getenv("APP_KEY")
+static_assets = StaticAssets(app) # Fingerprinted files from build_assets.py, when built
+# Goes into every ETag, so pages cached before a deploy (old markup, old hashed asset URLs) are
+# never revalidated afterwards. DEPLOY_ID covers deploys that change only Python code.
+PAGE_VERSION = make_etag(
+    static_assets.version,
+    os.getenv("DEPLOY_ID"),
+    [path.read_bytes() for path in sorted((BASE_DIR / "templates").rglob("*.html"))],
+)
+# Where each request's time goes (db, api, password, render): Server-Timing header and /metrics
+request_metrics = metrics.RequestMetrics(app, server_timing=os.getenv("SERVER_TIMING", "1") == "1")
+# Flags requests over the SQL budget, N+1 loops and slow full scans; see /admin/queries
+query_profiler = QueryProfiler(
+    app,
+    max_queries=int(os.getenv("QUERY_BUDGET_COUNT", "20")),
+    max_ms=float(os.getenv("QUERY_BUDGET_MS", "100")),
+    slow_ms=float(os.getenv("SLOW_QUERY_MS", "20")),
+    repeat_limit=int(os.getenv("QUERY_REPEAT_LIMIT", "5")),
+)
 
-def get_api_key():
-    key = os.getenv("API_KEY")
-    if not key:
-        raise RuntimeError("not a valid api key for variable")
-    return key
+# Pooled SQLite connections in WAL mode, checked out per request through get_db()
+db_pool = ConnectionPool(
+    DATABASE,
+    busy_timeout=int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000")),
+    cached_statements=int(os.getenv("DB_STATEMENT_CACHE", "256")),
+    factory=ProfiledConnection,
+)
 
+# Shared Clash Royale API client (pooled session, timeouts, retries, circuit breaker)
+cr_api = client_from_env()
 
-def get_available_pfp(): # Get all available pfps for dropdown menu in profile_edit
-    pfp_dir = BASE_DIR / "static" / "pfp"
-    if not pfp_dir.exists():
-        return []
-    pfp_files = []
-    for file in sorted(pfp_dir.iterdir()):
-        if file.suffix in ['.webp', '.png']:
-            pfp_files.append(file.stem)
-    return pfp_files
+# Cache of player API responses shared by home, profile and register (times in seconds)
+player_cache = PlayerCache(
+    metrics.wrap("api", cr_api.get_player),
+    ttl=int(os.getenv("PLAYER_CACHE_TTL", "300")),
+    stale_ttl=int(os.getenv("PLAYER_CACHE_STALE_TTL", "3600")),
+    negative_ttl=int(os.getenv("PLAYER_CACHE_NEGATIVE_TTL", "600")),
+    max_size=int(os.getenv("PLAYER_CACHE_SIZE", "512")),
+)
+
+# Refreshes a stale snapshot in the background when a page shows it, so pages never wait on the
+# API (max_age in seconds). The sweep of every registered player is refresh_players.py on cron.
+snapshot_refresher = SnapshotRefresher(
+    DATABASE,
+    cr_api.get_player,
+    max_age=int(os.getenv("PLAYER_SNAPSHOT_MAX_AGE", "600")),
+    on_update=player_cache.put,
+)
+
+
+# Profile pictures for the profile_edit dropdown and validation, drawn from the sprite atlas when built
+pfp_manifest = PfpManifest(BASE_DIR / "static" / "pfp", static_assets.pfp_sprite.get("classes"))
+app.jinja_env.globals.update(
+    pfp_class=pfp_manifest.css_class,
+    pfp_classes=pfp_manifest.classes,
+    pfp_sprite_css=static_assets.pfp_sprite.get("css"),
+)
+app.jinja_env.filters["highlight"] = search.highlight
 
 
 # Connect to database
 def get_db():
     if "db" not in g:
-        g.db = sqlite3.connect(DATABASE)
-        g.db.row_factory = sqlite3.Row
+        g.db = db_pool.acquire()
     return g.db
 
 
-# Close databse connection on exit
-@app.teardown_appcontext
-def close_db(exception=None):
+# Write limits per route: burst size and tokens regained per second. A signed-in member is
+# limited by user id alone. Logged-out forms fall back to the client IP, and a whole club
+# meeting can sit behind one campus or venue NAT, so those buckets are sized for a room full
+# of members; login also limits each username/email tried, which is what stops guessing.
+RATE_LIMITS = {
+    "chat_send": Policy(capacity=8, rate=1 / 2),
+    "announcement": Policy(capacity=3, rate=1 / 60),
+    "login": Policy(capacity=10, rate=1 / 30),
+    "login_ip": Policy(capacity=100, rate=1 / 3),
+    "register": Policy(capacity=30, rate=1 / 60),
+}
+rate_limiter = RateLimiter(RATE_LIMITS, get_db=get_db)
+
+
+def rate_limited(policy, ip_policy=None, form_key=None): # Apply a RATE_LIMITS policy to a route's POST requests
+    # Logged out: ip_policy (default `policy`) per IP, plus `policy` per value of the form_key field
+    def decorator(view):
+        @wraps(view)
+        def wrapped(*args, **kwargs):
+            if request.method == "POST":
+                if session.get("user_id"):
+                    buckets = [(policy, f"user:{session['user_id']}")]
+                else:
+                    buckets = [(ip_policy or policy, f"ip:{request.remote_addr}")]
+                    value = request.form.get(form_key, "").strip().lower() if form_key else ""
+                    if value:
+                        buckets.append((policy, f"{form_key}:{value}"))
+                wait = rate_limiter.hit(buckets)
+                if wait:
+                    retry_after = str(ceil(wait))
+                    if request.is_json:
+                        return {"error": "Too many requests, slow down."}, 429, {"Retry-After": retry_after}
+                    flash(f"Too many attempts, try again in {retry_after} seconds.", "error")
+                    return redirect(request.url)
+            return view(*args, **kwargs)
+        return wrapped
+    return decorator
+
+
+# Password hashing runs in a bounded process pool so a login rush can't tie up every worker
+passwords = service_from_env()
+
+
+@app.errorhandler(PasswordServiceBusy)
+def password_service_busy(e):
+    flash("Lots of people are logging in right now, try again in a few seconds.", "error")
+    return redirect(request.url)
+
+
+# Rendered fragments keyed by the data versions they were built from, so writes never need to evict them
+fragment_cache = FragmentCache(max_entries=int(os.getenv("FRAGMENT_CACHE_SIZE", "128")))
+
+
+def current_versions(): # data_versions counters, read at most once per request
+    if "versions" not in g:
+        g.versions = get_versions(get_db())
+    return g.versions
+
+
+# mod_wsgi runs several processes, and each has its own in-memory caches. Writes bump counters in
+# users.db, so every process sees them on its next request and drops what they cover.
+coherence = Coherence()
+
+
+@app.before_request
+def sync_caches():
+    if request.endpoint != "static":
+        coherence.sync(current_versions())
+
+
+def cached_fragment(name, tables, render, variant=None):
+    versions = current_versions()
+    key = (name, variant, tuple(versions.get(t, 0) for t in tables))
+    html = fragment_cache.get("fragments", key)
+    if html is None:
+        html = fragment_cache.set("fragments", key, Markup(render()))
+    return html
+
+
+def conditional_get(*tables, extra=None): # Answer 304 when nothing the page is built from has changed
+    def decorator(view):
+        @wraps(view)
+        def wrapped(*args, **kwargs):
+            # Pages with pending flash messages are one-offs, never validate those
+            if request.method not in ("GET", "HEAD") or "_flashes" in session:
+                return view(*args, **kwargs)
+            versions = current_versions()
+            etag = make_etag(
+                PAGE_VERSION,
+                request.full_path,
+                [versions.get(t, 0) for t in tables],
+                sorted(session.items()), # nav bar, admin controls and "you" rows come from the session
+                extra() if extra else None,
+            )
+            if etag in request.if_none_match:
+                response = Response(status=304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                # A view that flashed or changed the session rendered something we can't revalidate
+                if response.status_code != 200 or session.modified:
+                    return response
+            response.set_etag(etag)
+            response.headers["Cache-Control"] = "private, no-cache"
+            return response
+        return wrapped
+    return decorator
+
+
+def player_snapshot_etag(): # When the viewer's player data on home was fetched, so a new snapshot changes the ETag
+    if not session.get("user_id"):
+        return None
+    player_tag = session.get("player_tag")
+    row = get_db().execute("SELECT fetched_at FROM player_snapshots WHERE player_tag = ?", (player_tag,)).fetchone()
+    if row is None:
+        return None
+    # Checked here rather than in the view, which a 304 never runs
+    if time.time() - row["fetched_at"] > snapshot_refresher.max_age:
+        snapshot_refresher.request_refresh(player_tag)
+    return row["fetched_at"]
+
+
+# Player API data for page views, read from player_snapshots and refreshed in the background when stale.
+# Only registered players get a snapshot; any other tag someone looks up stays in the in-memory
+# player_cache (bounded, with negative entries for unknown tags). Never writes in the request.
+def get_player_data(player_tag, registered=True):
+    db = get_db()
+    snapshot = get_snapshot(db, player_tag)
+    if snapshot is not None:
+        data, fetched_at = snapshot
+        if time.time() - fetched_at > snapshot_refresher.max_age:
+            snapshot_refresher.request_refresh(player_tag)
+        return data
+    # Never fetched before, so this one view has to wait on the API
+    data = player_cache.get(player_tag)
+    if registered:
+        snapshot_refresher.request_save(player_tag, data)
+    return data
+
+
+# Hand the connection back to the pool, early for a view that is about to block
+def release_db():
     db = g.pop("db", None)
     if db is not None:
-        db.close()
+        db_pool.release(db)
+
+
+# Hand the connection back to the pool on exit
+@app.teardown_appcontext
+def close_db(exception=None):
+    release_db()
+
+
+# A write that couldn't get the SQLite lock within DB_BUSY_TIMEOUT_MS (short under serve_async.py)
+# is the server being busy, not broken: tell the client to retry rather than answer 500
+@app.errorhandler(sqlite3.OperationalError)
+def database_locked(e):
+    if "locked" not in str(e):
+        raise e
+    release_db()
+    if request.is_json:
+        return {"error": "The server is busy, try again in a moment."}, 503, {"Retry-After": "1"}
+    return "The server is busy, try again in a moment.", 503, {"Retry-After": "1", "Content-Type": "text/plain"}
 
 
 @app.route("/")
@@ -54,40 +271,38 @@ def index():
 
 
 @app.route("/home")
+@conditional_get("announcements", "users", extra=player_snapshot_etag)
 def home():
     db = get_db()
-    # recent_announcements = db.execute(
-    #     "SELECT id, pfp, rarity, username, cr_username, announcement, created_at FROM announcements ORDER BY created_at DESC LIMIT 3"
-    # ).fetchall()
-    recent_announcements = db.execute("""
-        SELECT announcements.announcement,
-               announcements.created_at,
-               users.username,
-               users.cr_username,
-               users.pfp,
-               users.rarity
-        FROM announcements
-        JOIN users ON announcements.user_id = users.id
-        ORDER BY announcements.created_at DESC
-        LIMIT 3
-    """).fetchall()
+    recent_announcements_html = cached_fragment("recent_announcements", ("announcements", "users"), lambda: render_template(
+        "_recent_announcements.html",
+        recent_announcements=db.execute("""
+            SELECT announcements.announcement,
+                   announcements.created_at,
+                   users.username,
+                   users.cr_username,
+                   users.pfp,
+                   users.rarity
+            FROM announcements
+            JOIN users ON announcements.user_id = users.id
+            ORDER BY announcements.created_at DESC
+            LIMIT 3
+        """).fetchall(),
+    ))
     if not session.get("user_id"): # User not logged in
-        return render_template("home.html", data=None, recent_announcements=recent_announcements)
+        return render_template("home.html", data=None, recent_announcements_html=recent_announcements_html)
     else: # User logged in
         player_tag = session.get('player_tag')
-        url = f"https://api.clashroyale.com/v1/players/%23{player_tag}"
-        headers = {"Authorization": f"Bearer {get_api_key()}"}
-
-        try: # TODO: Remove unnecesary API calls, they really slow it down!!!!
-            response = requests.get(url, headers=headers)
-            response.raise_for_status()
-            data = response.json()
-            return render_template("home.html", data=data, recent_announcements=recent_announcements)
+        try:
+            data = get_player_data(player_tag)
+            return render_template("home.html", data=data, recent_announcements_html=recent_announcements_html)
         except requests.RequestException as e:
-            return render_template("home.html", data=None, recent_announcements=recent_announcements)    
+            return render_template("home.html", data=None, recent_announcements_html=recent_announcements_html)
 
 
 @app.route("/announcements", methods=["GET", "POST"])
+@rate_limited("announcement")
+@conditional_get("announcements", "users")
 def announcements():
     db = get_db()
     if (request.method == "POST"):
@@ -97,25 +312,29 @@ def announcements():
                 "INSERT INTO announcements (user_id, announcement) VALUES (?, ?)",
                 (user_id, announcement),
             )
+        bump(db, "announcements")
         db.commit()
+        g.pop("versions", None)
         flash("Announcement posted.", "success")
-    # announcements = db.execute(
-    #     "SELECT id, pfp, rarity, username, cr_username, announcement, created_at FROM announcements ORDER BY created_at DESC"
-    # ).fetchall()
-    announcements = db.execute("""
-        SELECT announcements.announcement,
-               announcements.created_at,
-               announcements.id,
-               users.username,
-               users.cr_username,
-               users.pfp,
-               users.rarity
-        FROM announcements
-        JOIN users ON announcements.user_id = users.id
-        ORDER BY announcements.created_at DESC
-        LIMIT 50
-    """).fetchall()
-    return render_template("announcements.html", announcements=announcements)
+    is_admin = bool(session.get("is_admin"))
+    announcements_html = cached_fragment("announcements", ("announcements", "users"), lambda: render_template(
+        "_announcements.html",
+        is_admin=is_admin,
+        announcements=db.execute("""
+            SELECT announcements.announcement,
+                   announcements.created_at,
+                   announcements.id,
+                   users.username,
+                   users.cr_username,
+                   users.pfp,
+                   users.rarity
+            FROM announcements
+            JOIN users ON announcements.user_id = users.id
+            ORDER BY announcements.created_at DESC
+            LIMIT 50
+        """).fetchall(),
+    ), variant=is_admin)
+    return render_template("announcements.html", announcements_html=announcements_html)
 
 
 @app.route("/announcements/delete/<int:aid>", methods=["POST"])
@@ -126,6 +345,7 @@ def announcement_delete(aid):
     db = get_db()
     try:
         db.execute("DELETE FROM announcements WHERE id = ?", (aid,))
+        bump(db, "announcements")
         db.commit()
         flash("Announcement deleted.", "success")
         return redirect(url_for("announcements"))
@@ -137,6 +357,7 @@ def announcement_delete(aid):
 
 
 @app.route("/register", methods=["GET", "POST"])
+@rate_limited("register")
 def register():
     if request.method == "GET": # Serve form
             return render_template("register.html")
@@ -163,25 +384,28 @@ def register():
         if len(password) < 8:
             flash("Password must be at least 8 characters.", "error")
             return render_template("register.html")
-        url = f"https://api.clashroyale.com/v1/players/%23{player_tag}"
-        headers = {"Authorization": f"Bearer {get_api_key()}"}
-
         try:
-            response = requests.get(url, headers=headers)
-            response.raise_for_status()
-            data = response.json()
-        except requests.RequestException as e:
+            data = player_cache.get(player_tag)
+        except PlayerNotFound:
             flash("Enter valid player tag.", "error")
-            return render_template("register.html")  
+            return render_template("register.html")
+        except requests.RequestException as e:
+            # API unreachable: the tag can't be checked, and an unchecked one could hold a real player's tag
+            flash("Couldn't reach Clash Royale to check your player tag, please try again in a few minutes.", "error")
+            return render_template("register.html")
         cr_username = data["name"]
         # Add account to database
         db = get_db()
         try:
-            password_hash = generate_password_hash(password)
-            db.execute(
+            with metrics.timed("password"):
+                password_hash = passwords.hash(password)
+            cur = db.execute(
                 "INSERT INTO users (username, email, password_hash, cr_username, player_tag, is_admin) VALUES (?, ?, ?, ?, ?, ?)",
                 (username, email, password_hash, cr_username, player_tag, is_admin),
             )
+            save_snapshot(db, player_tag, data)
+            enqueue_verification_email(db, cur.lastrowid, username, email)
+            bump(db, "users")
             db.commit()
             flash("Account created — please log in.", "success")
             return redirect(url_for("login"))
@@ -197,7 +421,46 @@ def register():
             return render_template("register.html")
 
 
+EMAIL_VERIFY_MAX_AGE = 3 * 86400
+
+
+def email_tokens():
+    return URLSafeTimedSerializer(app.secret_key, salt="verify-email")
+
+
+def enqueue_verification_email(db, user_id, username, email):
+    token = email_tokens().dumps({"user_id": user_id, "email": email})
+    jobs.enqueue(db, "send_email", {
+        "to": email,
+        "subject": "Confirm your UNH Clash Royale Club email",
+        "body": render_template("email/verify.txt", username=username,
+                                link=url_for("verify_email", token=token, _external=True)),
+    })
+
+
+@app.route("/verify-email/<token>")
+def verify_email(token):
+    try:
+        claims = email_tokens().loads(token, max_age=EMAIL_VERIFY_MAX_AGE)
+    except SignatureExpired:
+        flash("That confirmation link has expired.", "error")
+        return redirect(url_for("home"))
+    except BadSignature:
+        flash("That confirmation link isn't valid.", "error")
+        return redirect(url_for("home"))
+    db = get_db()
+    # The email must still match, so a link sent before an email change can't confirm the new one
+    db.execute(
+        "UPDATE users SET email_verified_at = COALESCE(email_verified_at, CURRENT_TIMESTAMP) WHERE id = ? AND email = ?",
+        (claims["user_id"], claims["email"]),
+    )
+    db.commit()
+    flash("Email confirmed, thanks!", "success")
+    return redirect(url_for("home"))
+
+
 @app.route("/login", methods=["GET", "POST"])
+@rate_limited("login", ip_policy="login_ip", form_key="identifier")
 def login():
     if request.method == "GET": # Serve form
         return render_template("login.html")
@@ -213,7 +476,14 @@ def login():
             "SELECT * FROM users WHERE username = ? COLLATE NOCASE OR email = ? COLLATE NOCASE",
             (identifier, identifier),
         ).fetchone()
-        if user and check_password_hash(user["password_hash"], password): # Login success
+        ok, new_hash = False, None
+        if user:
+            with metrics.timed("password"):
+                ok, new_hash = passwords.verify(user["password_hash"], password)
+        if ok: # Login success
+            if new_hash: # Hash cost settings changed since this password was stored
+                db.execute("UPDATE users SET password_hash = ? WHERE id = ?", (new_hash, user["id"]))
+                db.commit()
             session.clear()
             session["user_id"] = user["id"]
             session["pfp"] = user["pfp"]
@@ -242,21 +512,22 @@ def profile(ptag):
     you = False
     if session.get("player_tag") == ptag:
         you = True
-    url = f"https://api.clashroyale.com/v1/players/%23{ptag}"
-    headers = {"Authorization": f"Bearer {get_api_key()}"}
     # have to also get and send over name, username, rarity, pfp, etc. and use stuff we send instead of session.get in profile.html
     db = get_db()
     profile = db.execute(
         "SELECT username, player_tag, points, cr_username, rarity, pfp FROM users WHERE player_tag = ?", (ptag,)
     ).fetchone()
+    # From the ingested battlelogs (ingest_battles.py), no API call
+    record = battles.record(db, ptag)
+    rivalry = None
+    if session.get("player_tag") and not you:
+        rivalry = battles.head_to_head(db, session["player_tag"], ptag)
     try:
-        response = requests.get(url, headers=headers)
-        response.raise_for_status()
-        data = response.json()
-        return render_template("profile.html", profile=profile, data=data, you=you)
+        data = get_player_data(ptag, registered=profile is not None)
+        return render_template("profile.html", profile=profile, data=data, you=you, record=record, rivalry=rivalry)
     except requests.RequestException as e:
         flash("Unable to access Clash Royale API using player tag", "error")
-        return render_template("profile.html", profile=profile, data=None, you=you)
+        return render_template("profile.html", profile=profile, data=None, you=you, record=record, rivalry=rivalry)
 
 
 @app.route("/profile/delete", methods=["POST"])
@@ -267,24 +538,28 @@ def profile_delete():
     uid = session["user_id"]
     db = get_db()
     try:
-        # 1. Find participant ids linked to this user (supports multiple in case we want to allow joining multiple tournaments)
-        p_rows = db.execute("SELECT id FROM participants WHERE user_id = ?", (uid,)).fetchall()
-        pids = [r["id"] for r in p_rows]
-        # 2. Delete matches that reference those participant ids
-        if pids:
-            for pid in pids:
-                db.execute("DELETE FROM matches WHERE player1_id = ? OR player2_id = ?", (pid, pid))
-        # 3. Delete participant rows for this user
+        # 1. Delete matches that reference any of this user's participant rows (one statement,
+        # however many tournaments they're in; the tournament_id test lets it use the index)
+        db.execute("""
+            DELETE FROM matches
+            WHERE tournament_id IN (SELECT tournament_id FROM participants WHERE user_id = :uid)
+              AND (player1_id IN (SELECT id FROM participants WHERE user_id = :uid)
+                   OR player2_id IN (SELECT id FROM participants WHERE user_id = :uid))
+        """, {"uid": uid})
+        # 2. Delete participant rows for this user
         db.execute("DELETE FROM participants WHERE user_id = ?", (uid,))
-        # 4. Delete the user row
+        # 3. Delete the user row, and leave their old announcements and snapshot to the worker
         db.execute("DELETE FROM users WHERE id = ?", (uid,))
+        jobs.enqueue(db, "purge_user", {"user_id": uid, "player_tag": session.get("player_tag")})
+        bump(db, "users", "announcements")
+        invalidate_tournament(db)
         db.commit()
     except Exception as e:
         db.rollback()
         app.logger.exception("Error deleting profile for user %s: %s", uid, e)
         flash("Could not delete profile. Contact an admin.", "error")
         return redirect(url_for("profile"), ptag=session.get("player_tag"))
-    # 5. Clear session and redirect to home
+    # 4. Clear session and redirect to home
     session.clear()
     flash("Your profile was deleted.", "success")
     return redirect(url_for("home"))
@@ -309,7 +584,7 @@ def profile_edit():
     current_username = user["username"]
     current_email = user["email"]
     current_player_tag = user["player_tag"]
-    available_pfp = get_available_pfp()
+    available_pfp = pfp_manifest.names()
     if request.method == "GET":
         return render_template(
             "profile_edit.html",
@@ -327,6 +602,16 @@ def profile_edit():
     form_new_password = request.form.get("new_password", "")
     form_new_password_confirm = request.form.get("new_password_confirm", "")
     # Validate
+    if form_pfp and form_pfp not in pfp_manifest:
+        flash("Pick a profile picture from the list.", "error")
+        return render_template(
+            "profile_edit.html",
+            pfp=current_pfp,
+            username=form_username,
+            email=form_email,
+            player_tag=current_player_tag,
+            available_pfp=available_pfp,
+        )
     change_password = False
     new_hash = None
     if form_new_password or form_new_password_confirm:
@@ -350,7 +635,9 @@ def profile_edit():
             "SELECT password_hash FROM users WHERE id = ?",
             (uid,)
         ).fetchone()
-        if not check_password_hash(row["password_hash"], form_current_password):
+        with metrics.timed("password"):
+            ok = passwords.verify(row["password_hash"], form_current_password)[0]
+        if not ok:
             flash("Current password is incorrect.", "error")
             return render_template(
                 "profile_edit.html",
@@ -358,7 +645,8 @@ def profile_edit():
                 email=form_email,
                 player_tag=current_player_tag,
             )
-        new_hash = generate_password_hash(form_new_password)
+        with metrics.timed("password"):
+            new_hash = passwords.hash(form_new_password)
         change_password = True
     # Update database
     try:
@@ -384,6 +672,7 @@ def profile_edit():
                 "UPDATE users SET password_hash = ? WHERE id = ?",
                 (new_hash, uid),
             )
+        bump(db, "users")
         db.commit()
     except sqlite3.IntegrityError as e:
         msg = str(e).lower()
@@ -404,83 +693,187 @@ def profile_edit():
     return redirect(url_for("profile", ptag=current_player_tag))
 
 
+CHAT_KEEPALIVE = 10 # Seconds between keepalives (and database catch-up checks) on idle streams
+# Streams are closed after this long, EventSource reconnects with Last-Event-ID
+CHAT_STREAM_SECONDS = int(os.getenv("CHAT_STREAM_SECONDS", "60"))
+CHAT_POLL_SECONDS = 20
+# Seconds before a viewer turned away for lack of a free stream slot checks again
+CHAT_POLL_RETRY = 5
+CHAT_NEWEST = 2 ** 63 - 1 # before_id that starts history at the newest message
+# Every open stream or long-poll ties up a server thread for its whole length. Under mod_wsgi's
+# small thread pool only a few may wait at once and everyone else short-polls; serve_async.py
+# raises the cap, since a waiting greenlet costs next to nothing.
+chat_broadcaster = ChatBroadcaster(max_listeners=int(os.getenv("CHAT_MAX_STREAMS", "4")))
+
+
+CHAT_HISTORY_PAGE_SIZE = 50
+CHAT_SELECT = """
+    SELECT chat_messages.id,
+           chat_messages.message,
+           chat_messages.created_at,
+           users.username,
+           users.pfp,
+           users.rarity
+    FROM chat_messages
+    JOIN users ON chat_messages.user_id = users.id
+"""
+
+
+# Chat is paged with (created_at, id) keysets on idx_chat_messages_created_at_id. The cursor's
+# created_at is read from the nearest surviving message, so a deleted cursor message still works.
+def load_chat_messages_after(db, after_id, limit=100): # Oldest first
+    rows = db.execute(CHAT_SELECT + """
+        WHERE (chat_messages.created_at, chat_messages.id) > (
+            (SELECT created_at FROM chat_messages WHERE id >= :after_id ORDER BY id LIMIT 1), :after_id)
+        ORDER BY chat_messages.created_at ASC, chat_messages.id ASC
+        LIMIT :limit
+    """, {"after_id": after_id, "limit": limit}).fetchall()
+    return [dict(r) for r in rows]
+
+
+def load_chat_messages_before(db, before_id, limit=CHAT_HISTORY_PAGE_SIZE): # Newest first
+    rows = db.execute(CHAT_SELECT + """
+        WHERE (chat_messages.created_at, chat_messages.id) < (
+            (SELECT created_at FROM chat_messages WHERE id <= :before_id ORDER BY id DESC LIMIT 1), :before_id)
+        ORDER BY chat_messages.created_at DESC, chat_messages.id DESC
+        LIMIT :limit
+    """, {"before_id": before_id, "limit": limit}).fetchall()
+    return [dict(r) for r in rows]
+
+
+def get_last_seen_id(*values): # First usable message id out of a header/query arg list, else the newest message
+    for value in values:
+        if value and value.isdigit():
+            return int(value)
+    row = get_db().execute("SELECT MAX(id) FROM chat_messages").fetchone()
+    return row[0] or 0
+
+
 @app.route("/chat")
 def chat():
-    db = get_db()
-    messages = db.execute("""
-        SELECT chat_messages.message,
-               chat_messages.created_at,
-               users.username,
-               users.pfp,
-               users.rarity
-        FROM chat_messages
-        JOIN users ON chat_messages.user_id = users.id
-        ORDER BY chat_messages.created_at ASC
-        LIMIT 50
-    """).fetchall()
-    return render_template("chat.html", messages=messages)
+    # Latest window, oldest at the top; older history is pulled in from /chat/history on scroll
+    messages = load_chat_messages_before(get_db(), CHAT_NEWEST)
+    messages.reverse()
+    last_id = messages[-1]["id"] if messages else 0
+    return render_template("chat.html", messages=messages, last_id=last_id)
+
+
+@app.route("/chat/history")
+def chat_history(): # Older messages, newest first, from before_id (or the newest message)
+    before_id = request.args.get("before_id", type=int) or CHAT_NEWEST
+    limit = max(1, min(request.args.get("limit", CHAT_HISTORY_PAGE_SIZE, type=int), 100))
+    messages = load_chat_messages_before(get_db(), before_id, limit)
+    next_before_id = messages[-1]["id"] if len(messages) == limit else None
+    return {"messages": messages, "next_before_id": next_before_id}
+
+
+@app.route("/chat/since")
+def chat_since(): # Messages newer than after_id, oldest first, without waiting
+    after_id = request.args.get("after_id", 0, type=int)
+    limit = max(1, min(request.args.get("limit", 100, type=int), 100))
+    messages = load_chat_messages_after(get_db(), after_id, limit)
+    return {"messages": messages, "has_more": len(messages) == limit}
+
+
+@app.route("/chat/stream")
+def chat_stream(): # Server-Sent Events feed of new messages
+    last_id = get_last_seen_id(request.headers.get("Last-Event-ID"), request.args.get("last_id"))
+
+    def send(messages):
+        nonlocal last_id
+        for m in messages:
+            yield f"id: {m['id']}\ndata: {json.dumps(m)}\n\n"
+            last_id = m["id"]
+
+    def generate():
+        messages = load_chat_messages_after(get_db(), last_id)
+        release_db() # not held while the stream waits
+        if not chat_broadcaster.join():
+            # No stream slot free: send what's new and close, and EventSource comes back with
+            # Last-Event-ID after the retry delay, which makes this a short poll
+            yield f"retry: {CHAT_POLL_RETRY * 1000}\n\n"
+            yield from send(messages)
+            return
+        try:
+            yield "retry: 3000\n\n"
+            deadline = time.monotonic() + CHAT_STREAM_SECONDS
+            while True:
+                yield from send(messages)
+                if time.monotonic() >= deadline:
+                    return
+                messages = chat_broadcaster.wait(last_id, CHAT_KEEPALIVE)
+                if not messages:
+                    # Nothing published here, pick up anything another process wrote meanwhile
+                    messages = load_chat_messages_after(get_db(), last_id)
+                    release_db()
+                    if not messages:
+                        yield ": keepalive\n\n"
+        finally:
+            chat_broadcaster.leave()
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.route("/chat/poll")
+def chat_poll(): # Long-poll fallback for browsers without EventSource
+    last_id = get_last_seen_id(request.args.get("after_id"))
+    messages = load_chat_messages_after(get_db(), last_id)
+    release_db()
+    if messages:
+        return {"messages": messages}
+    if not chat_broadcaster.join():
+        return {"messages": [], "retry_after": CHAT_POLL_RETRY}
+    try:
+        return {"messages": chat_broadcaster.wait(last_id, CHAT_POLL_SECONDS)}
+    finally:
+        chat_broadcaster.leave()
 
 
 @app.route("/chat/send", methods=["POST"])
+@rate_limited("chat_send")
 def chat_send():
     if not session.get("user_id"):
         return {"error": "Not logged in"}, 401
-    # TODO: ONLY ADMINS CAN ACCESS CHAT FOR NOW UNTIL WE PUT A LIMIT
-    if not session.get("is_admin"):
-        return {"error": "Admins only"}, 403
-    ################################################################
     data = request.get_json()
     message = data.get("message", "").strip()
     if not message:
         return {"error": "Empty message"}, 400
     db = get_db()
-    db.execute(
+    cur = db.execute(
         "INSERT INTO chat_messages (user_id, message) VALUES (?, ?)",
         (session["user_id"], message),
     )
+    row = db.execute("SELECT created_at FROM chat_messages WHERE id = ?", (cur.lastrowid,)).fetchone()
     db.commit()
-    return {
+    sent = {
+        "id": cur.lastrowid,
         "username": session["username"],
         "pfp": session["pfp"],
         "rarity": session["rarity"],
-        "message": message
+        "message": message,
+        "created_at": row["created_at"],
     }
-
-
-def create_bracket(participants):
-    # Sort by seed (0 means unspecified -> lowest priority)
-    participants_sorted = sorted(participants, key=lambda p: (p[2] if p[2] is not None else 9999))
-    ids = [p[0] for p in participants_sorted]
-    n = len(ids)
-    if n == 0:
-        return []
-    # Next power of two
-    next_pow2 = 1 << (ceil(log2(n)))
-    byes = next_pow2 - n
-    # Simple seeding pairing: pair highest with lowest, etc.
-    # Create initial bracket slots of length next_pow2 with byes as None
-    slots = ids[:] + [None] * byes
-    # Initial round pairings
-    pairs = []
-    while len(slots) > 1:
-        new_pairs = []
-        for i in range(0, len(slots), 2):
-            new_pairs.append((slots[i], slots[i+1] if i+1 < len(slots) else None))
-        pairs.append(new_pairs)
-        # Winners placeholders for next round: use None placeholders
-        slots = [None] * (len(new_pairs))
-    return pairs
+    chat_broadcaster.publish(sent)
+    return sent
 
 
 @app.route("/tournaments")
+@conditional_get("tournaments")
 def tournaments_list():
     db = get_db()
-    rows = db.execute("""
-        SELECT id, name, description, date, location
-        FROM tournaments
-        ORDER BY datetime(date) ASC
-    """).fetchall()
-    return render_template("tournaments/list.html", tournaments=rows)
+    tournaments_html = cached_fragment("tournaments", ("tournaments",), lambda: render_template(
+        "tournaments/_list.html",
+        tournaments=db.execute("""
+            SELECT id, name, description, date, location
+            FROM tournaments
+            ORDER BY datetime(date) ASC
+        """).fetchall(),
+    ))
+    return render_template("tournaments/list.html", tournaments_html=tournaments_html)
 
 
 @app.route("/tournaments/create", methods=["GET", "POST"])
@@ -505,6 +898,7 @@ def tournaments_create():
             formatted_date = date
         db = get_db()
         db.execute("INSERT INTO tournaments (name, description, date, location) VALUES (?, ?, ?, ?)", (name, description, formatted_date, location))
+        bump(db, "tournaments")
         db.commit()
         flash("Tournament created.", "success")
         return redirect(url_for("tournaments_list"))
@@ -518,10 +912,13 @@ def tournament_join(tid):
     db = get_db()
     user_id = session["user_id"]
     # Ensure tournament exists
-    tour = db.execute("SELECT id FROM tournaments WHERE id = ?", (tid,)).fetchone()
+    tour = db.execute("SELECT id, ended_at FROM tournaments WHERE id = ?", (tid,)).fetchone()
     if not tour:
         flash("Tournament not found.", "error")
         return redirect(url_for("tournaments_list"))
+    if tour["ended_at"]:
+        flash("This tournament has ended.", "error")
+        return redirect(url_for("tournament_view", tid=tid))
     # Prevent joining same tournament twice
     existing = db.execute(
         "SELECT id FROM participants WHERE tournament_id = ? AND user_id = ?",
@@ -537,6 +934,7 @@ def tournament_join(tid):
             "INSERT INTO participants (tournament_id, name, seed, user_id) VALUES (?, ?, ?, ?)",
             (tid, name, None, user_id)
         )
+        invalidate_tournament(db, tid)
         db.commit()
     except sqlite3.IntegrityError as e:
         flash("You can only be in one tournament at once, please leave the other tournament to join this one.", "error")
@@ -567,56 +965,118 @@ def tournament_leave(tid):
         return redirect(url_for("tournament_view", tid=tid))
     # Delete the participant row
     db.execute("DELETE FROM participants WHERE id = ?", (participant["id"],))
+    invalidate_tournament(db, tid)
     db.commit()
     flash("You have left the tournament.", "success")
     return redirect(url_for("tournament_view", tid=tid))
 
 
-@app.route("/tournaments/<int:tid>", methods=["GET", "POST"])
-def tournament_view(tid):
-    db = get_db()
-    tour = db.execute("SELECT id, name, description, date, location FROM tournaments WHERE id = ?", (tid,)).fetchone()
+# View models and rendered brackets per tournament, keyed on the "tournament" and "tournament:<tid>"
+# counters that every write changing them bumps
+tournament_cache = FragmentCache(max_entries=int(os.getenv("TOURNAMENT_CACHE_SIZE", "64")))
+coherence.watch("tournament", lambda tid: tournament_cache.invalidate("tournament", int(tid) if tid else None))
+
+
+def invalidate_tournament(db, tid=None): # Before the commit; tid=None covers every tournament (e.g. a user deleted)
+    bump(db, "tournament" if tid is None else f"tournament:{tid}")
+
+
+def tournament_version(tid):
+    versions = current_versions()
+    return versions.get("tournament", 0), versions.get(f"tournament:{tid}", 0)
+
+
+def load_tournament(db, tid): # Cached {tournament, participants, rounds} model, None if not found
+    version = tournament_version(tid)
+    model = tournament_cache.get("tournament", tid)
+    if model is not None and model["version"] == version:
+        return model
+    tour = db.execute("SELECT id, name, description, date, location, ended_at FROM tournaments WHERE id = ?", (tid,)).fetchone()
     if not tour:
-        flash("Tournament not found.", "error")
-        return redirect(url_for("tournaments_list"))
-    # Load participants
+        return None
     part_rows = db.execute(
         "SELECT id, name, seed, user_id FROM participants WHERE tournament_id = ? ORDER BY seed ASC",
         (tid,)
     ).fetchall()
-    participants = [(r["id"], r["name"], r["seed"], r["user_id"]) for r in part_rows]
-    # Determine whether current user has joined
-    joined = False
-    current_user_id = session.get("user_id")
-    if current_user_id:
-        for r in part_rows:
-            if r["user_id"] == current_user_id:
-                joined = True
-                break
+    participants = [dict(r) for r in part_rows]
+    match_rows = db.execute(
+        "SELECT id, round, player1_id, player2_id, score1, score2, winner_id FROM matches WHERE tournament_id = ? ORDER BY round, id",
+        (tid,)
+    ).fetchall()
+    model = {
+        "tournament": dict(tour),
+        "participants": participants,
+        "user_ids": {p["user_id"] for p in participants},
+        "rounds": bracket_view(participants, match_rows),
+        "results": [dict(r) for r in db.execute(
+            "SELECT name, place, points FROM tournament_results WHERE tournament_id = ? ORDER BY place, name", (tid,)
+        )],
+        "html": {},
+        "version": version,
+    }
+    return tournament_cache.set("tournament", tid, model)
+
+
+@app.route("/tournaments/<int:tid>", methods=["GET", "POST"])
+def tournament_view(tid):
+    db = get_db()
+    model = load_tournament(db, tid)
+    if model is None:
+        flash("Tournament not found.", "error")
+        return redirect(url_for("tournaments_list"))
+    participants = model["participants"]
     # Generate bracket if requested
     if request.args.get("generate") == "1":
-        db.execute("DELETE FROM matches WHERE tournament_id = ?", (tid,))
-        rounds = create_bracket([(r[0], r[1], r[2]) for r in participants])
-        if rounds:
-            round1 = rounds[0]
-            for p1, p2 in round1:
-                db.execute(
-                    "INSERT INTO matches (tournament_id, round, player1_id, player2_id) VALUES (?, ?, ?, ?)",
-                    (tid, 1, p1, p2)
-                )
-            db.commit()
-            flash("Bracket generated (round 1 created).", "success")
+        if not session.get("is_admin"):
+            flash("Admin privileges required to start tournaments.", "error")
             return redirect(url_for("tournament_view", tid=tid))
-    # Load matches grouped by round
-    match_rows = db.execute("SELECT * FROM matches WHERE tournament_id = ? ORDER BY round, id", (tid,)).fetchall()
-    rounds = {}
-    for m in match_rows:
-        rounds.setdefault(m["round"], []).append(m)
+        if model["tournament"]["ended_at"]:
+            flash("This tournament has ended.", "error")
+            return redirect(url_for("tournament_view", tid=tid))
+        if len(participants) < 2:
+            flash("At least two participants are needed to start.", "error")
+            return redirect(url_for("tournament_view", tid=tid))
+        rows = generate_bracket(db, tid, [(p["id"], p["name"], p["seed"]) for p in participants])
+        invalidate_tournament(db, tid)
+        db.commit()
+        flash(f"Bracket generated ({max(r[0] for r in rows)} rounds).", "success")
+        return redirect(url_for("tournament_view", tid=tid))
+    # Bracket markup only differs for admins (result forms), so it is rendered at most twice per change
+    is_admin = bool(session.get("is_admin"))
+    bracket_html = model["html"].get(is_admin)
+    if bracket_html is None:
+        bracket_html = model["html"][is_admin] = Markup(render_template(
+            "tournaments/_bracket.html", tournament=model["tournament"], rounds=model["rounds"], is_admin=is_admin
+        ))
     return render_template("tournaments/view.html",
-                           tournament=tour,
+                           tournament=model["tournament"],
                            participants=participants,
-                           rounds=rounds,
-                           joined=joined)
+                           results=model["results"],
+                           bracket_html=bracket_html,
+                           joined=session.get("user_id") in model["user_ids"])
+
+
+@app.route("/tournaments/<int:tid>/matches/<int:mid>/result", methods=["POST"])
+def match_result(tid, mid):
+    if not session.get("is_admin"):
+        flash("Admin privileges required to report results.", "error")
+        return redirect(url_for("tournament_view", tid=tid))
+    score1 = request.form.get("score1", type=int)
+    score2 = request.form.get("score2", type=int)
+    if score1 is None or score2 is None or score1 < 0 or score2 < 0:
+        flash("Enter both scores.", "error")
+        return redirect(url_for("tournament_view", tid=tid))
+    db = get_db()
+    try:
+        report_result(db, tid, mid, score1, score2)
+        invalidate_tournament(db, tid)
+        db.commit()
+    except ValueError as e:
+        db.rollback()
+        flash(str(e), "error")
+        return redirect(url_for("tournament_view", tid=tid))
+    flash("Result recorded.", "success")
+    return redirect(url_for("tournament_view", tid=tid))
 
 
 @app.route("/tournaments/<int:tid>/delete", methods=["POST"])
@@ -627,17 +1087,30 @@ def tournament_delete(tid):
         return redirect(url_for("tournament_view", tid=tid))
     db = get_db()
     # Ensure tournament exists
-    tour = db.execute("SELECT id FROM tournaments WHERE id = ?", (tid,)).fetchone()
+    tour = db.execute("SELECT id, name, date FROM tournaments WHERE id = ?", (tid,)).fetchone()
     if not tour:
         flash("Tournament not found.", "error")
         return redirect(url_for("tournaments_list"))
     try:
+        # Let entrants know, sent by the worker once the delete has committed
+        jobs.enqueue_many(db, "send_email", [{
+            "to": entrant["email"],
+            "subject": f"{tour['name']} has been cancelled",
+            "body": render_template("email/tournament_cancelled.txt", username=entrant["username"], tournament=tour),
+        } for entrant in db.execute("""
+            SELECT users.username, users.email
+            FROM participants
+            JOIN users ON users.id = participants.user_id
+            WHERE participants.tournament_id = ?
+        """, (tid,)).fetchall()])
         # Delete matches for tournament
         db.execute("DELETE FROM matches WHERE tournament_id = ?", (tid,))
         # Delete participants for tournament
         db.execute("DELETE FROM participants WHERE tournament_id = ?", (tid,))
         # Delete tournament
         db.execute("DELETE FROM tournaments WHERE id = ?", (tid,))
+        bump(db, "tournaments")
+        invalidate_tournament(db, tid)
         db.commit()
     except Exception as e:
         db.rollback()
@@ -650,36 +1123,173 @@ def tournament_delete(tid):
 
 @app.route("/tournaments/<int:tid>/end", methods=["POST"])
 def tournament_end(tid):
-    pass
+    if not session.get("is_admin"):
+        flash("Admin privileges required to end tournaments.", "error")
+        return redirect(url_for("tournament_view", tid=tid))
+    db = get_db()
+    try:
+        awarded = end_tournament(db, tid)
+        bump(db, "tournaments", "users")
+        invalidate_tournament(db, tid)
+        db.commit()
+    except ValueError as e:
+        db.rollback()
+        flash(str(e), "error")
+        return redirect(url_for("tournament_view", tid=tid))
+    except Exception as e:
+        db.rollback()
+        app.logger.exception("Error ending tournament %s: %s", tid, e)
+        flash("Could not end tournament. Contact an admin.", "error")
+        return redirect(url_for("tournament_view", tid=tid))
+    flash(f"Tournament ended, points awarded to {awarded} players.", "success")
+    return redirect(url_for("tournament_view", tid=tid))
+
+
+LEADERBOARD_PAGE_SIZE = 10
+LEADERBOARD_START = (2 ** 63 - 1, 0)
 
 
 @app.route("/leaderboard")
+@conditional_get("users")
 def leaderboard():
-    # Get top ten
     db = get_db()
-    top_rows = db.execute(
-        "SELECT username, pfp, rarity, cr_username, player_tag, points FROM users ORDER BY points DESC LIMIT 10"
-    ).fetchall()
-    # Convert to dicts and assign rank (ties share rank)
-    top = []
-    for player in top_rows:
-        rank_row = db.execute("SELECT COUNT(*) AS cnt FROM users WHERE points > ?", (player["points"],)).fetchone()
-        rank = rank_row["cnt"] + 1
-        top.append({"rank": rank, "pfp": player["pfp"], "rarity": player["rarity"], "username": player["username"], "cr_username": player["cr_username"], "player_tag": player["player_tag"], "points": player["points"]})
-    # Get current user's ranking
+    # Keyset cursor "<points>:<id>" of the last row on the previous page, first page starts above any score
+    after = request.args.get("after", "")
+    after_points, after_id = LEADERBOARD_START
+    if after:
+        try:
+            after_points, after_id = (int(x) for x in after.split(":"))
+        except ValueError:
+            return redirect(url_for("leaderboard"))
+    # One query: seek the page off idx_users_points, RANK() it, then shift the page-local ranks by the
+    # number of players ahead of the page's first row (ties that started on an earlier page included)
+    rows = db.execute("""
+        WITH page AS (
+            SELECT id, username, pfp, rarity, cr_username, player_tag, points
+            FROM users
+            WHERE points <= :points AND (points < :points OR id > :id)
+            ORDER BY points DESC, id
+            LIMIT :limit
+        ), head AS (
+            SELECT first.points,
+                   (SELECT COUNT(*) FROM users WHERE users.points > first.points) AS ahead,
+                   (SELECT COUNT(*) FROM users WHERE users.points = first.points AND users.id < first.id) AS tied
+            FROM (SELECT points, id FROM page ORDER BY points DESC, id LIMIT 1) AS first
+        )
+        SELECT page.*,
+               RANK() OVER (ORDER BY page.points DESC) + head.ahead
+               + CASE WHEN page.points < head.points THEN head.tied ELSE 0 END AS rank
+        FROM page, head
+        ORDER BY page.points DESC, page.id
+    """, {"points": after_points, "id": after_id, "limit": LEADERBOARD_PAGE_SIZE + 1}).fetchall()
+    top = rows[:LEADERBOARD_PAGE_SIZE]
+    next_cursor = None
+    if len(rows) > LEADERBOARD_PAGE_SIZE:
+        next_cursor = f"{top[-1]['points']}:{top[-1]['id']}"
+    # Get current user's ranking from live points, counted off the points index
     current_user = None
-    user_row = None
     user_id = session.get("user_id")
     if user_id:
-        rank_row = db.execute("SELECT COUNT(*) AS cnt FROM users WHERE points > ?", (session.get("points"),)).fetchone()
-        rank = rank_row["cnt"] + 1
-        current_user = {"rank": rank, "pfp": session.get("pfp"), "rarity": session.get("rarity"), "username": session.get("username"), "cr_username": session.get("cr_username"), "player_tag": session.get("player_tag"), "points": session.get("points")}
+        current_user = db.execute("""
+            SELECT username, pfp, rarity, cr_username, player_tag, points,
+                   (SELECT COUNT(*) FROM users AS ahead WHERE ahead.points > users.points) + 1 AS rank
+            FROM users
+            WHERE id = ?
+        """, (user_id,)).fetchone()
+        if current_user and session.get("points") != current_user["points"]:
+            session["points"] = current_user["points"]
     return render_template(
         "leaderboard.html",
         top=top,
         you=current_user,
+        first_page=not after,
+        next_cursor=next_cursor,
     )
-    return render_template("leaderboard.html")    
+
+
+SEARCH_PAGE_SIZE = 20
+SEARCH_PREVIEW_SIZE = 5 # Per scope when searching everything at once
+SEARCH_MAX_PAGE = search.WINDOW // SEARCH_PAGE_SIZE # Past the ranked window there's nothing more to show
+SEARCH_SCOPES = ("announcements", "chat", "members")
+
+
+@app.route("/search")
+def search_page():
+    q = request.args.get("q", "").strip()
+    scope = request.args.get("scope", "all")
+    if scope not in SEARCH_SCOPES:
+        scope = "all"
+    page = max(1, min(request.args.get("page", 1, type=int), SEARCH_MAX_PAGE))
+    db = get_db()
+    results = {}
+    has_next = False
+    if scope == "all": # A few of the best hits from each, with links to the full list
+        for name in SEARCH_SCOPES:
+            results[name] = search.search(db, name, q, SEARCH_PREVIEW_SIZE)
+    else:
+        # One extra row to know whether there's a next page
+        rows = search.search(db, scope, q, SEARCH_PAGE_SIZE + 1, (page - 1) * SEARCH_PAGE_SIZE)
+        results[scope] = rows[:SEARCH_PAGE_SIZE]
+        has_next = len(rows) > SEARCH_PAGE_SIZE and page < SEARCH_MAX_PAGE
+    return render_template("search.html", q=q, scope=scope, page=page, results=results, has_next=has_next,
+                           preview_size=SEARCH_PREVIEW_SIZE, searched=search.match_query(q) is not None)
+
+
+@app.route("/search/members")
+def search_members(): # Autocomplete: members whose names or tag start with what's been typed
+    limit = max(1, min(request.args.get("limit", 8, type=int), 20))
+    rows = search.search(get_db(), "members", request.args.get("q", ""), limit, prefix=True)
+    return {"members": [dict(r) for r in rows]}
+
+
+@app.route("/admin/cache")
+def admin_cache():
+    if not session.get("is_admin"):
+        return {"error": "Admins only"}, 403
+    return {
+        "player_cache": player_cache.stats(),
+        "cr_api_circuit": cr_api.breaker.state,
+        "tournament_cache": tournament_cache.stats(),
+        "fragment_cache": fragment_cache.stats(),
+        "coherence": coherence.stats(),
+        "passwords": passwords.stats(),
+    }
+
+
+@app.route("/admin/queries")
+def admin_queries():
+    if not session.get("is_admin"):
+        return {"error": "Admins only"}, 403
+    return query_profiler.report()
+
+
+@app.route("/admin/jobs")
+def admin_jobs():
+    if not session.get("is_admin"):
+        return {"error": "Admins only"}, 403
+    return jobs.stats(get_db())
+
+
+@app.route("/admin/jobs/<int:job_id>/retry", methods=["POST"])
+def admin_job_retry(job_id): # Put a dead job back in the queue
+    if not session.get("is_admin"):
+        return {"error": "Admins only"}, 403
+    db = get_db()
+    if not jobs.retry(db, job_id):
+        return {"error": "No dead job with that id"}, 404
+    db.commit()
+    return {"retried": job_id}
+
+
+@app.route("/metrics")
+def metrics_endpoint(): # Prometheus scrape target: admins, or a scraper holding METRICS_TOKEN
+    token = os.getenv("METRICS_TOKEN")
+    authorized = session.get("is_admin") or (
+        token and hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {token}")
+    )
+    if not authorized:
+        return {"error": "Admins only"}, 403
+    return Response(request_metrics.render(), mimetype="text/plain; version=0.0.4")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,140 @@
+import time
+
+from bulk_fetch import iter_fetch
+
+# Battle history pulled from /players/{tag}/battlelog into battles / battle_players
+# (migration 12). The API only ever returns a player's last 25 battles, so ingestion runs
+# regularly and keeps a per-player cursor, the newest battle_time stored, to skip what it
+# already has. A battle two members both played comes back in both logs; the natural key
+# (time plus both sides' tags) stores it once.
+
+INSERT_BATTLE_SQL = (
+    "INSERT OR IGNORE INTO battles (battle_time, side0_tags, side1_tags, side0_crowns, side1_crowns, type, game_mode) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?)"
+)
+INSERT_PLAYER_SQL = (
+    "INSERT OR IGNORE INTO battle_players (player_tag, battle_id, side, won, trophy_change) "
+    "VALUES (?, (SELECT id FROM battles WHERE battle_time = ? AND side0_tags = ? AND side1_tags = ?), ?, ?, ?)"
+)
+SAVE_CURSOR_SQL = (
+    "INSERT INTO battle_cursors (player_tag, last_battle_time, checked_at) VALUES (?, ?, ?) "
+    "ON CONFLICT(player_tag) DO UPDATE SET "
+    "last_battle_time = NULLIF(MAX(COALESCE(last_battle_time, ''), COALESCE(excluded.last_battle_time, '')), ''), "
+    "checked_at = excluded.checked_at"
+)
+
+
+def parse_battle_time(value):
+    # "20240101T120000.000Z" -> "2024-01-01 12:00:00", the format the rest of the schema sorts by
+    return f"{value[0:4]}-{value[4:6]}-{value[6:8]} {value[9:11]}:{value[11:13]}:{value[13:15]}"
+
+
+def battle_rows(battle):
+    # One battlelog entry -> (battle row, [battle_players rows])
+    sides = [battle.get("team", []), battle.get("opponent", [])]
+    tags = [sorted(p["tag"].lstrip("#") for p in side) for side in sides]
+    if tags[1] < tags[0]:
+        sides.reverse()
+        tags.reverse()
+    crowns = [max((p.get("crowns", 0) for p in side), default=0) for side in sides]
+    when = parse_battle_time(battle["battleTime"])
+    key = (when, ",".join(tags[0]), ",".join(tags[1]))
+    row = (*key, crowns[0], crowns[1], battle.get("type", "unknown"), (battle.get("gameMode") or {}).get("name"))
+    players = []
+    for side, members in enumerate(sides):
+        other = crowns[1 - side]
+        won = None if crowns[side] == other else int(crowns[side] > other)
+        for p in members:
+            players.append((p["tag"].lstrip("#"), *key, side, won, p.get("trophyChange")))
+    return row, players
+
+
+def new_battles(log, since):
+    # Entries newer than the cursor, as (battle_time, battle row, player rows), one at a time
+    for battle in log:
+        battle_time = parse_battle_time(battle["battleTime"])
+        if since is None or battle_time > since:
+            row, players = battle_rows(battle)
+            yield battle_time, row, players
+
+
+class Ingest:
+    # Rows collected across players and written in executemany batches. A player's cursor
+    # goes in the same batch as their battles, so a crash never moves a cursor past battles
+    # that weren't stored, and a rerun just picks up where the last commit left off.
+
+    def __init__(self, db, batch_size=500):
+        self.db = db
+        self.batch_size = batch_size
+        self.battles, self.players, self.cursors = [], [], []
+        self.inserted = 0
+
+    def add(self, tag, log, since):
+        newest = since
+        for battle_time, row, players in new_battles(log, since):
+            self.battles.append(row)
+            self.players.extend(players)
+            newest = max(newest or "", battle_time)
+        self.cursors.append((tag, newest, time.time()))
+        if len(self.battles) >= self.batch_size or len(self.cursors) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self.battles:
+            before = self.db.total_changes
+            self.db.executemany(INSERT_BATTLE_SQL, self.battles)
+            self.inserted += self.db.total_changes - before
+            self.db.executemany(INSERT_PLAYER_SQL, self.players)
+        if self.cursors:
+            self.db.executemany(SAVE_CURSOR_SQL, self.cursors)
+        self.db.commit()
+        self.battles, self.players, self.cursors = [], [], []
+
+
+def ingest_battlelogs(db, tags, fetch, workers=8, limiter=None, min_interval=0, batch_size=500):
+    # Pulls every tag's battlelog (fetch(tag) -> list) and stores the battles that are new.
+    # Players checked less than min_interval seconds ago are skipped without an API call.
+    # Returns (players fetched, battles inserted, {tag: error}).
+    cursors = {tag: (last, checked) for tag, last, checked in
+               db.execute("SELECT player_tag, last_battle_time, checked_at FROM battle_cursors")}
+    cutoff = time.time() - min_interval
+    due = [tag for tag in tags if tag not in cursors or cursors[tag][1] < cutoff]
+    ingest = Ingest(db, batch_size)
+    errors = {}
+    # Responses are handled as they arrive and only the new rows are kept until the next flush
+    for tag, log, error in iter_fetch(due, fetch, workers, limiter):
+        if error is not None:
+            errors[tag] = error
+            continue
+        ingest.add(tag, log, cursors.get(tag, (None, 0))[0])
+    ingest.flush()
+    return len(due), ingest.inserted, errors
+
+
+def record(db, player_tag):
+    # Wins, losses and draws over every stored battle
+    row = db.execute("""
+        SELECT COUNT(*) AS battles,
+               COALESCE(SUM(won = 1), 0) AS wins,
+               COALESCE(SUM(won = 0), 0) AS losses
+        FROM battle_players
+        WHERE player_tag = ?
+    """, (player_tag,)).fetchone()
+    battles, wins, losses = row["battles"], row["wins"], row["losses"]
+    return {"battles": battles, "wins": wins, "losses": losses, "draws": battles - wins - losses,
+            "win_rate": round(100 * wins / battles, 1) if battles else None}
+
+
+def head_to_head(db, player_tag, opponent_tag):
+    # Battles where the two were on opposite sides, from player_tag's point of view
+    row = db.execute("""
+        SELECT COUNT(*) AS battles,
+               COALESCE(SUM(me.won = 1), 0) AS wins,
+               COALESCE(SUM(me.won = 0), 0) AS losses,
+               MAX(battles.battle_time) AS last_battle
+        FROM battle_players AS me
+        JOIN battle_players AS them ON them.player_tag = :opponent AND them.battle_id = me.battle_id
+        JOIN battles ON battles.id = me.battle_id
+        WHERE me.player_tag = :player AND them.side != me.side
+    """, {"player": player_tag, "opponent": opponent_tag}).fetchone()
+    return dict(row)
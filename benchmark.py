@@ -0,0 +1,215 @@
+import argparse
+import json
+import logging
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from math import ceil
+from pathlib import Path
+
+import requests
+from flask import Flask
+from flask.sessions import SecureCookieSessionInterface
+
+from concurrency_check import free_port, wait_until_up
+from database import connect
+from fake_cr_api import FakeApiServer
+from seed_db import seed
+
+BASE_DIR = Path(__file__).parent
+RESULTS_DIR = BASE_DIR / "bench_results"
+SECRET_KEY = "benchmark"
+
+# Relative weight of each route in the request mix
+DEFAULT_MIX = {"home": 30, "leaderboard": 20, "chat": 20, "tournament": 15, "profile": 15, "guest_chat": 5}
+# Routes sent without a session, as a logged-out visitor
+GUEST_ROUTES = {"guest_chat": "/chat"}
+
+
+def session_cookie(user):
+    # Sign a logged-in session the way the app would, so the run doesn't go through /login
+    # (and its rate limit and password hashing) once per simulated user
+    signer = Flask("benchmark", static_folder=None)
+    signer.secret_key = SECRET_KEY
+    return SecureCookieSessionInterface().get_signing_serializer(signer).dumps(user)
+
+
+def percentile(sorted_values, p):
+    # Nearest-rank percentile of an already sorted list, None for an empty one
+    if not sorted_values:
+        return None
+    return sorted_values[max(0, ceil(p / 100 * len(sorted_values)) - 1)]
+
+
+def round_ms(value):
+    return None if value is None else round(value, 2)
+
+
+def summarize(samples, elapsed):
+    # samples: (route, seconds, status) -> per-route and overall latency percentiles in ms.
+    # Percentiles only count successful requests (a fast 500 isn't a fast page); a route
+    # where every request failed gets None for them and its error count.
+    routes = {}
+    for route in sorted({s[0] for s in samples}) + ["all"]:
+        rows = [s for s in samples if route == "all" or s[0] == route]
+        errors = sum(1 for s in rows if s[2] is None or s[2] >= 400)
+        latencies = sorted(s[1] * 1000 for s in rows if s[2] is not None and s[2] < 400)
+        routes[route] = {
+            "requests": len(rows),
+            "errors": errors,
+            "rps": round(len(rows) / elapsed, 1) if elapsed > 0 else 0,
+            "p50_ms": round_ms(percentile(latencies, 50)),
+            "p95_ms": round_ms(percentile(latencies, 95)),
+            "p99_ms": round_ms(percentile(latencies, 99)),
+            "max_ms": round_ms(latencies[-1] if latencies else None),
+        }
+    return routes
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BASE_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Driver:
+    # Closed-loop load: `concurrency` threads, each with its own logged-in session (and a
+    # logged-out one for GUEST_ROUTES), pick a route from the mix, send it, record the latency
+    # and go again until the time is up.
+
+    def __init__(self, base_url, users, tournament_ids, mix, concurrency=16, rng_seed=1):
+        self.base_url = base_url
+        self.users = users
+        self.tournament_ids = tournament_ids
+        self.routes = list(mix)
+        self.weights = [mix[r] for r in self.routes]
+        self.concurrency = concurrency
+        self.rng_seed = rng_seed
+        self.samples = []
+        self._lock = threading.Lock()
+
+    def path(self, route, rng, user):
+        if route in GUEST_ROUTES:
+            return GUEST_ROUTES[route]
+        if route == "tournament":
+            return f"/tournaments/{rng.choice(self.tournament_ids)}"
+        if route == "profile":
+            return f"/profile/{rng.choice(self.users)['player_tag']}"
+        return f"/{route}"
+
+    def worker(self, index, deadline, record_after):
+        rng = random.Random(self.rng_seed * 1000 + index)
+        user = self.users[index % len(self.users)]
+        http = requests.Session()
+        http.cookies.set("session", session_cookie(user))
+        guest = requests.Session()
+        samples = []
+        while time.perf_counter() < deadline:
+            route = rng.choices(self.routes, self.weights)[0]
+            start = time.perf_counter()
+            try:
+                client = guest if route in GUEST_ROUTES else http
+                status = client.get(self.base_url + self.path(route, rng, user), timeout=30, allow_redirects=False).status_code
+            except requests.RequestException:
+                status = None
+            if start >= record_after:
+                samples.append((route, time.perf_counter() - start, status))
+        with self._lock:
+            self.samples.extend(samples)
+
+    def run(self, duration, warmup=2.0):
+        start = time.perf_counter()
+        record_after = start + warmup
+        deadline = record_after + duration
+        threads = [threading.Thread(target=self.worker, args=(i, deadline, record_after)) for i in range(self.concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return summarize(self.samples, duration)
+
+
+def server_command(server, port):
+    if server == "gevent":
+        return [sys.executable, str(BASE_DIR / "serve_async.py"), "--host", "127.0.0.1", "--port", str(port)]
+    return [sys.executable, "-m", "flask", "--app", "app", "run", "--host", "127.0.0.1", "--port", str(port),
+            "--with-threads", "--no-reload", "--no-debugger"]
+
+
+def benchmark(server="threaded", duration=20.0, warmup=2.0, concurrency=16, latency=0.2, mix=None, seed_options=None):
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    mix = mix or DEFAULT_MIX
+    seed_options = dict(seed_options or {})
+    with FakeApiServer(latency=latency) as upstream, tempfile.TemporaryDirectory() as tmp:
+        db_path = Path(tmp) / "users.db"
+        seed(db_path, **seed_options)
+        conn = connect(db_path)
+        users = [dict(user_id=r["id"], username=r["username"], pfp=r["pfp"], rarity=r["rarity"],
+                      cr_username=r["cr_username"], player_tag=r["player_tag"], points=r["points"],
+                      is_admin=r["is_admin"])
+                 for r in conn.execute("SELECT * FROM users ORDER BY id")]
+        tournament_ids = [r[0] for r in conn.execute("SELECT id FROM tournaments")]
+        conn.close()
+        port = free_port()
+        env = dict(os.environ, DATABASE_PATH=str(db_path), CR_API_BASE=upstream.base_url, API_KEY="benchmark",
+                   APP_KEY=SECRET_KEY)
+        process = subprocess.Popen(server_command(server, port), cwd=BASE_DIR, env=env,
+                                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            base_url = f"http://127.0.0.1:{port}"
+            wait_until_up(f"{base_url}/leaderboard")
+            routes = Driver(base_url, users, tournament_ids, mix, concurrency).run(duration, warmup)
+        finally:
+            process.terminate()
+            process.wait()
+    return {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "config": {"server": server, "duration": duration, "warmup": warmup, "concurrency": concurrency,
+                   "upstream_latency": latency, "mix": mix, "seed": seed_options},
+        "routes": routes,
+    }
+
+
+def print_report(result, baseline=None):
+    print(f"{'route':<12}{'reqs':>7}{'err':>5}{'rps':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+    for route, r in result["routes"].items():
+        p50, p95, p99 = ("-" if r[k] is None else r[k] for k in ("p50_ms", "p95_ms", "p99_ms"))
+        line = f"{route:<12}{r['requests']:>7}{r['errors']:>5}{r['rps']:>8}{p50:>9}{p95:>9}{p99:>9}"
+        old = (baseline or {}).get("routes", {}).get(route)
+        if old and old["rps"] and old["p95_ms"] and r["p95_ms"] is not None:
+            line += f"   rps {(r['rps'] / old['rps'] - 1) * 100:+.0f}%, p95 {(r['p95_ms'] / old['p95_ms'] - 1) * 100:+.0f}%"
+        print(line)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test the app against a seeded database and a fake Clash Royale API")
+    parser.add_argument("--server", choices=["threaded", "gevent"], default="threaded",
+                        help="threaded Flask server (like mod_wsgi threads) or serve_async.py")
+    parser.add_argument("--duration", type=float, default=20, help="seconds measured, after the warmup")
+    parser.add_argument("--warmup", type=float, default=2, help="seconds of load before measuring")
+    parser.add_argument("--concurrency", type=int, default=16, help="simulated users sending requests back to back")
+    parser.add_argument("--latency", type=float, default=0.2, help="fake API delay per call in seconds")
+    parser.add_argument("--mix", type=json.loads, default=None, help='route weights as JSON, e.g. \'{"home": 1, "chat": 3}\'')
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--messages", type=int, default=5000)
+    parser.add_argument("--tournaments", type=int, default=10)
+    parser.add_argument("--snapshots", type=float, default=0.9, help="fraction of users with a stored API snapshot")
+    parser.add_argument("--output", type=Path, default=None, help="JSON results file (default bench_results/<commit>.json)")
+    parser.add_argument("--compare", type=Path, default=None, help="earlier results file to show changes against")
+    args = parser.parse_args()
+    result = benchmark(args.server, args.duration, args.warmup, args.concurrency, args.latency, args.mix,
+                       {"users": args.users, "messages": args.messages, "tournaments": args.tournaments,
+                        "snapshots": args.snapshots})
+    baseline = json.loads(args.compare.read_text()) if args.compare else None
+    print_report(result, baseline)
+    output = args.output or RESULTS_DIR / f"{result['commit'] or 'results'}-{args.server}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(result, indent=2))
+    print(f"Saved {output}")
@@ -0,0 +1,180 @@
+from math import ceil, log2
+
+
+def seed_order(size):
+    # Seed number for each first-round slot of a `size`-player bracket, paired 1-vs-N:
+    # 8 -> [1, 8, 4, 5, 2, 7, 3, 6], so the top two seeds can only meet in the final
+    order = [1]
+    while len(order) < size:
+        n = len(order) * 2
+        order = [s for seed in order for s in (seed, n + 1 - seed)]
+    return order
+
+
+def seeded(participants):
+    # participants are (id, name, seed) tuples; seed None/0 means unseeded -> after the seeded
+    # players, in join (id) order
+    return sorted(participants, key=lambda p: (0, p[2]) if p[2] else (1, p[0]))
+
+
+def build_bracket(participants):
+    # Every match of a single-elimination bracket as (round, position, player1_id, player2_id,
+    # winner_id) tuples. Byes only ever occur in round 1 (against the top seeds) and are
+    # resolved immediately by putting the player straight into their round 2 slot.
+    ids = [p[0] for p in seeded(participants)]
+    n = len(ids)
+    if n < 2:
+        return []
+    size = 1 << ceil(log2(n))
+    slots = [ids[seed - 1] if seed <= n else None for seed in seed_order(size)]
+    rounds = int(log2(size))
+    matches = {}
+    for position in range(size // 2):
+        p1, p2 = slots[2 * position], slots[2 * position + 1]
+        winner = p1 if p2 is None else (p2 if p1 is None else None)
+        matches[(1, position)] = [1, position, p1, p2, winner]
+    for rnd in range(2, rounds + 1):
+        for position in range(size >> rnd):
+            matches[(rnd, position)] = [rnd, position, None, None, None]
+    if rounds > 1:
+        for position in range(size // 2):
+            winner = matches[(1, position)][4]
+            if winner is not None:
+                matches[(2, position // 2)][2 + position % 2] = winner
+    return [tuple(m) for m in matches.values()]
+
+
+def generate_bracket(db, tid, participants):
+    # Replaces the tournament's matches with a full bracket: one DELETE and one executemany,
+    # caller commits so the whole bracket lands in a single transaction
+    rows = build_bracket(participants)
+    db.execute("DELETE FROM matches WHERE tournament_id = ?", (tid,))
+    db.executemany(
+        "INSERT INTO matches (tournament_id, round, position, player1_id, player2_id, winner_id) VALUES (?, ?, ?, ?, ?, ?)",
+        [(tid, *row) for row in rows],
+    )
+    return rows
+
+
+def report_result(db, tid, match_id, score1, score2):
+    # Records a result and moves the winner into their next-round slot: round r position p
+    # feeds round r + 1 position p // 2 (player1 if p is even, else player2). Caller commits.
+    match = db.execute(
+        "SELECT id, round, position, player1_id, player2_id FROM matches WHERE id = ? AND tournament_id = ?",
+        (match_id, tid),
+    ).fetchone()
+    if match is None:
+        raise ValueError("Match not found.")
+    if match["position"] is None:
+        raise ValueError("This bracket predates result tracking, regenerate it first.")
+    if match["player1_id"] is None or match["player2_id"] is None:
+        raise ValueError("Both players must be set before reporting a result.")
+    if score1 == score2:
+        raise ValueError("Matches can't end in a tie.")
+    winner_id = match["player1_id"] if score1 > score2 else match["player2_id"]
+    next_match = db.execute(
+        "SELECT id, winner_id FROM matches WHERE tournament_id = ? AND round = ? AND position = ?",
+        (tid, match["round"] + 1, match["position"] // 2),
+    ).fetchone()
+    if next_match is not None and next_match["winner_id"] is not None:
+        raise ValueError("The next round match has already been played.")
+    db.execute(
+        "UPDATE matches SET score1 = ?, score2 = ?, winner_id = ? WHERE id = ?",
+        (score1, score2, winner_id, match_id),
+    )
+    if next_match is not None:
+        slot = "player1_id" if match["position"] % 2 == 0 else "player2_id"
+        db.execute(f"UPDATE matches SET {slot} = ? WHERE id = ?", (winner_id, next_match["id"]))
+    return winner_id
+
+
+def bracket_view(participants, matches):
+    # Structured per-round model for the template, built in one pass with an id -> name map
+    # instead of scanning the participant list for every player of every match
+    names = {p["id"]: p["name"] for p in participants}
+    rounds = []
+    for m in matches:
+        if not rounds or rounds[-1]["number"] != m["round"]:
+            rounds.append({"number": m["round"], "matches": []})
+        p1, p2 = m["player1_id"], m["player2_id"]
+        rounds[-1]["matches"].append({
+            "id": m["id"],
+            "player1": names.get(p1),
+            "player2": names.get(p2),
+            "score1": m["score1"],
+            "score2": m["score2"],
+            "winner": names.get(m["winner_id"]),
+            "bye": m["round"] == 1 and not (p1 and p2),
+            "ready": bool(p1 and p2) and m["winner_id"] is None,
+        })
+    return rounds
+
+
+# Points by finishing tier: champion, runner-up, semifinalists, quarterfinalists, ...
+# the last entry is what everyone knocked out earlier gets
+TOURNAMENT_POINTS = (10, 7, 5, 3, 1)
+
+# One statement per table, whatever the field size. A player's tier is how many rounds short
+# of the final they went out (+1 unless they won it): 0 champion, 1 runner-up, 2 semifinal...
+# place is the usual shared placing for that tier: 1, 2, 3, 5, 9, ...
+RESULTS_SQL = """
+    WITH appearances AS (
+        SELECT player1_id AS participant_id, round FROM matches WHERE tournament_id = :tid AND player1_id IS NOT NULL
+        UNION ALL
+        SELECT player2_id, round FROM matches WHERE tournament_id = :tid AND player2_id IS NOT NULL
+    ), reached AS (
+        SELECT participant_id, MAX(round) AS round FROM appearances GROUP BY participant_id
+    ), final AS (
+        SELECT round AS last_round, winner_id AS champion_id
+        FROM matches WHERE tournament_id = :tid ORDER BY round DESC LIMIT 1
+    ), tiers AS (
+        SELECT participants.user_id, participants.name,
+               final.last_round - reached.round + (reached.participant_id != final.champion_id) AS tier
+        FROM participants
+        JOIN reached ON reached.participant_id = participants.id
+        CROSS JOIN final
+        WHERE participants.tournament_id = :tid
+    ), points_table(tier, points) AS (
+        VALUES {points_values}
+    )
+    INSERT INTO tournament_results (tournament_id, user_id, name, place, points)
+    SELECT :tid, tiers.user_id, tiers.name,
+           CASE tiers.tier WHEN 0 THEN 1 ELSE (1 << (tiers.tier - 1)) + 1 END,
+           points_table.points
+    FROM tiers
+    JOIN points_table ON points_table.tier = min(tiers.tier, :last_tier)
+"""
+
+
+def end_tournament(db, tid, points=TOURNAMENT_POINTS):
+    # Completes a tournament as set-based statements in the caller's transaction: record
+    # placements, award users.points from them, then clear matches and participants so
+    # everyone can join the next event. Returns the number of players awarded points.
+    ended = db.execute("SELECT ended_at FROM tournaments WHERE id = ?", (tid,)).fetchone()
+    if ended is None:
+        raise ValueError("Tournament not found.")
+    if ended["ended_at"]:
+        raise ValueError("This tournament has already ended.")
+    final = db.execute(
+        "SELECT winner_id FROM matches WHERE tournament_id = ? ORDER BY round DESC, id LIMIT 1", (tid,)
+    ).fetchone()
+    if final is None:
+        raise ValueError("This tournament hasn't started.")
+    if final["winner_id"] is None:
+        raise ValueError("Report the final before ending the tournament.")
+    params = {"tid": tid, "last_tier": len(points) - 1}
+    params.update({f"tier{i}": i for i in range(len(points))})
+    params.update({f"points{i}": p for i, p in enumerate(points)})
+    points_values = ", ".join(f"(:tier{i}, :points{i})" for i in range(len(points)))
+    db.execute(RESULTS_SQL.format(points_values=points_values), params)
+    awarded = db.execute("SELECT changes()").fetchone()[0]
+    db.execute("""
+        UPDATE users
+        SET points = points + (SELECT SUM(points) FROM tournament_results
+                               WHERE tournament_id = :tid AND user_id = users.id)
+        WHERE id IN (SELECT user_id FROM tournament_results WHERE tournament_id = :tid)
+    """, {"tid": tid})
+    db.execute("DELETE FROM matches WHERE tournament_id = ?", (tid,))
+    db.execute("DELETE FROM participants WHERE tournament_id = ?", (tid,))
+    db.execute("UPDATE tournaments SET ended_at = CURRENT_TIMESTAMP WHERE id = ?", (tid,))
+    return awarded
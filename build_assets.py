@@ -0,0 +1,226 @@
+import argparse
+import gzip
+import hashlib
+import json
+import math
+import re
+from io import BytesIO
+from pathlib import Path
+
+# Pillow and brotli are only needed on the machine that runs the build (pip install -r
+# requirements-build.txt); without them the originals are still fingerprinted and gzipped,
+# just not resized or brotli-compressed.
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+STATIC_DIR = Path(__file__).parent / "static"
+DIST_DIR = STATIC_DIR / "dist"
+MANIFEST_NAME = "manifest.json"
+
+# Source image -> CSS widths it is displayed at. Each width gets 1x and 2x renditions.
+IMAGES = {
+    "cr_background.jpg": [640],  # portrait, background-size: contain, so about the viewport height
+    "logo.png": [50, 32],  # header logo (.logo-image) and favicon
+}
+# Tried in order, browsers take the first <source>/image-set() entry they support
+IMAGE_FORMATS = [
+    ("avif", "image/avif", {"quality": 50}),
+    ("webp", "image/webp", {"quality": 80, "method": 6}),
+]
+ORIGINAL_FORMATS = {".jpg": ("JPEG", "image/jpeg", {"quality": 82, "optimize": True, "progressive": True}),
+                    ".png": ("PNG", "image/png", {"optimize": True})}
+TEXT_ASSETS = ["style.css", "main.js"]  # style.css after the images, it points at them
+
+# Every profile picture packed into one atlas, so a page of avatars is a single request. Cells
+# share the aspect ratio of most of the pictures (97x120) and are 100px wide, a bit over the
+# 75px .pfp width; pictures are scaled to fit and centred.
+PFP_DIR = STATIC_DIR / "pfp"
+PFP_SUFFIXES = (".webp", ".png")
+PFP_CELL = (100, 124)
+
+CSS_STATIC_URL = re.compile(r"""url\(\s*['"]?/static/([^'")]+)['"]?\s*\)""")
+CSS_IMAGE_DECLARATION = re.compile(r"""(background(?:-image)?\s*:\s*)url\(\s*['"]?/static/([^'")]+)['"]?\s*\)\s*;""")
+
+
+def fingerprint(data):
+    return hashlib.sha1(data).hexdigest()[:10]
+
+
+class Build:
+    def __init__(self, static_dir=STATIC_DIR, dist_dir=DIST_DIR):
+        self.static_dir = Path(static_dir)
+        self.dist_dir = Path(dist_dir)
+        # files: original filename -> hashed path (relative to static/)
+        # images: original filename -> {width: [(mime, 1x path, 2x path), ...]}, best format first
+        # encodings: hashed path -> precompressed encodings written next to it
+        # pfp_sprite: {"css": hashed stylesheet path, "classes": picture name -> CSS class}
+        # written: every file this build put in dist/, so the next build knows what to keep
+        self.manifest = {"files": {}, "images": {}, "encodings": {}, "pfp_sprite": {}, "written": []}
+
+    def write(self, name, data):
+        stem, dot, suffix = name.rpartition(".")
+        hashed = f"{stem}.{fingerprint(data)}.{suffix}"
+        (self.dist_dir / hashed).write_bytes(data)
+        self.manifest["written"].append(hashed)
+        return f"dist/{hashed}"
+
+    def build(self):
+        # The previous build's files stay: pages cached before a deploy still point at them
+        previous = self.previous_files()
+        self.dist_dir.mkdir(parents=True, exist_ok=True)
+        for name, widths in IMAGES.items():
+            data = (self.static_dir / name).read_bytes()
+            self.manifest["files"][name] = self.write(name, data)
+            if Image is not None:
+                self.manifest["images"][name] = self.build_image(name, data, widths)
+        if Image is not None:
+            self.manifest["pfp_sprite"] = self.build_pfp_sprite()
+        for name in TEXT_ASSETS:
+            data = (self.static_dir / name).read_bytes()
+            if name.endswith(".css"):
+                data = self.rewrite_css(data.decode()).encode()
+            path = self.write(name, data)
+            self.manifest["files"][name] = path
+            self.manifest["encodings"][path] = self.compress(path, data)
+        (self.dist_dir / MANIFEST_NAME).write_text(json.dumps(self.manifest, indent=2))
+        if previous is not None:
+            keep = previous | set(self.manifest["written"]) | {MANIFEST_NAME}
+            for path in self.dist_dir.iterdir():
+                if path.name not in keep:
+                    path.unlink()
+        return self.manifest
+
+    def previous_files(self):
+        # What the last build wrote, or None when that's unknown (then nothing is removed)
+        try:
+            return set(json.loads((self.dist_dir / MANIFEST_NAME).read_text())["written"])
+        except (FileNotFoundError, KeyError, ValueError):
+            return None
+
+    def build_image(self, name, data, widths):
+        source = Image.open(BytesIO(data))
+        stem, suffix = name.rsplit(".", 1)
+        original = ORIGINAL_FORMATS[f".{suffix}"]
+        variants = {}
+        for width in widths:
+            sized = {density: self.resize(source, width * density) for density in (1, 2)}
+            sources = []
+            for ext, mime, options in IMAGE_FORMATS + [(suffix, original[1], original[2])]:
+                image_format = original[0] if ext == suffix else ext.upper()
+                paths = []
+                for density in (1, 2):
+                    buffer = BytesIO()
+                    image = sized[density]
+                    if image_format == "JPEG":
+                        image = image.convert("RGB")
+                    try:
+                        image.save(buffer, image_format, **options)
+                    except (KeyError, OSError, ValueError):
+                        break  # this Pillow build has no encoder for the format
+                    paths.append(self.write(f"{stem}-{width}w{density}x.{ext}", buffer.getvalue()))
+                if len(paths) == 2:
+                    sources.append((mime, *paths))
+            variants[str(width)] = sources
+        return variants
+
+    def resize(self, image, width):
+        width = min(width, image.width)
+        height = round(image.height * width / image.width)
+        return image.resize((width, height), Image.LANCZOS)
+
+    def build_pfp_sprite(self):
+        files = sorted(f for f in PFP_DIR.iterdir() if f.suffix in PFP_SUFFIXES)
+        if not files:
+            return {}
+        cell_w, cell_h = PFP_CELL
+        cols = math.ceil(math.sqrt(len(files)))
+        rows = math.ceil(len(files) / cols)
+        atlas = Image.new("RGBA", (cols * cell_w, rows * cell_h))
+        classes = {}
+        rules = []
+        for index, path in enumerate(files):
+            col, row = index % cols, index // cols
+            image = Image.open(path).convert("RGBA")
+            image.thumbnail(PFP_CELL, Image.LANCZOS)  # only ever shrinks, like the <img> did
+            atlas.paste(image, (col * cell_w + (cell_w - image.width) // 2, row * cell_h + (cell_h - image.height) // 2))
+            css_class = f"pfp-{re.sub(r'[^a-z0-9]+', '-', path.stem.lower()).strip('-')}"
+            if css_class in classes.values():
+                css_class = f"{css_class}-{index}"
+            classes[path.stem] = css_class
+            x = col * 100 / (cols - 1) if cols > 1 else 0
+            y = row * 100 / (rows - 1) if rows > 1 else 0
+            rules.append(f".{css_class} {{ background-position: {x:.4f}% {y:.4f}%; }}")
+        buffer = BytesIO()
+        atlas.save(buffer, "WEBP", quality=75, method=6)
+        image_path = self.write("pfp-sprite.webp", buffer.getvalue())
+        # Percentages scale the atlas with the element, so .pfp (75px) and .chat-pfp (25px)
+        # both work off the same image
+        css = "\n".join([
+            ".pfp-sprite {",
+            "  display: inline-block;",
+            f"  aspect-ratio: {cell_w} / {cell_h};",
+            f'  background: url("{Path(image_path).name}") no-repeat;',
+            f"  background-size: {cols * 100}% {rows * 100}%;",
+            "}",
+            *rules,
+        ]).encode()
+        css_path = self.write("pfp-sprite.css", css)
+        self.manifest["encodings"][css_path] = self.compress(css_path, css)
+        return {"css": css_path, "classes": classes}
+
+    def rewrite_css(self, css):
+        # Background images become a resized fallback url() followed by an image-set() that
+        # modern browsers use instead; any other /static/ url() just gets its hashed name.
+        # Everything ends up in dist/ next to the stylesheet, so plain filenames resolve.
+        def declaration(match):
+            prop, name = match.groups()
+            sources = next(iter(self.manifest["images"].get(name, {}).values()), None)
+            if not sources:
+                return match.group(0)
+            fallback = Path(sources[-1][1]).name
+            image_set = ", ".join(
+                f'url("{Path(x1).name}") 1x type("{mime}"), url("{Path(x2).name}") 2x type("{mime}")'
+                for mime, x1, x2 in sources
+            )
+            return f'{prop}url("{fallback}");\n  {prop}image-set({image_set});'
+
+        def url(match):
+            path = self.manifest["files"].get(match.group(1))
+            return f'url("{Path(path).name}")' if path else match.group(0)
+
+        return CSS_STATIC_URL.sub(url, CSS_IMAGE_DECLARATION.sub(declaration, css))
+
+    def compress(self, path, data):
+        encodings = []
+        target = self.static_dir / path
+        if brotli is not None:
+            target.with_name(target.name + ".br").write_bytes(brotli.compress(data, quality=11))
+            self.manifest["written"].append(target.name + ".br")
+            encodings.append("br")
+        target.with_name(target.name + ".gz").write_bytes(gzip.compress(data, 9, mtime=0))
+        self.manifest["written"].append(target.name + ".gz")
+        encodings.append("gzip")
+        return encodings
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fingerprint, resize and precompress static assets into static/dist")
+    parser.parse_args()
+    manifest = Build().build()
+    if Image is None:
+        print("Pillow not installed, skipped resized image variants")
+    if brotli is None:
+        print("brotli not installed, skipped .br files")
+    for name, path in manifest["files"].items():
+        print(f"{name} -> {path}")
+    if manifest["pfp_sprite"]:
+        print(f"pfp sprite: {len(manifest['pfp_sprite']['classes'])} pictures -> {manifest['pfp_sprite']['css']}")
+    for name, widths in manifest["images"].items():
+        for width, sources in widths.items():
+            print(f"{name} @{width}px: {', '.join(mime for mime, *_ in sources)}")
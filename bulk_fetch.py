@@ -0,0 +1,57 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+
+
+class TokenBucket:
+    # Blocking token bucket: refills `rate` tokens per second up to `capacity`, so bursts
+    # of up to capacity requests go out at once and the long-run rate never exceeds `rate`.
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait = (tokens - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+def iter_fetch(tags, fetch, workers=16, limiter=None):
+    # Fetches every tag concurrently and yields (tag, data, error) as each one finishes.
+    # One failing tag only produces an error tuple, it never aborts the rest of the batch.
+    def fetch_one(tag):
+        if limiter is not None:
+            limiter.acquire()
+        return fetch(tag)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(fetch_one, tag): tag for tag in dict.fromkeys(tags)}
+        for future in as_completed(futures):
+            tag = futures[future]
+            try:
+                yield tag, future.result(), None
+            except requests.RequestException as e:
+                yield tag, None, e
+
+
+def fetch_all(tags, fetch, workers=16, limiter=None):
+    results, errors = {}, {}
+    for tag, data, error in iter_fetch(tags, fetch, workers, limiter):
+        if error is None:
+            results[tag] = data
+        else:
+            errors[tag] = error
+    return results, errors
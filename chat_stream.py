@@ -0,0 +1,46 @@
+import threading
+from collections import deque
+
+
+class ChatBroadcaster:
+    # In-process fan-out for new chat messages. chat_send() publishes each message once and
+    # every open stream/long-poll waiting in this process wakes up and reads it from the ring
+    # buffer, so delivering a message costs no extra queries per viewer.
+
+    # Each waiting stream or long-poll holds a server thread (a mod_wsgi thread, or a greenlet
+    # under serve_async.py), so at most max_listeners wait at once; join() says whether there
+    # was room, and a caller turned away answers straight away instead.
+
+    def __init__(self, history=200, max_listeners=4):
+        self._messages = deque(maxlen=history)
+        self._cond = threading.Condition()
+        self.last_id = 0
+        self.max_listeners = max_listeners
+        self.listeners = 0
+
+    def join(self):
+        with self._cond:
+            if self.listeners >= self.max_listeners:
+                return False
+            self.listeners += 1
+            return True
+
+    def leave(self):
+        with self._cond:
+            self.listeners -= 1
+
+    def publish(self, message):
+        with self._cond:
+            self._messages.append(message)
+            self.last_id = max(self.last_id, message["id"])
+            self._cond.notify_all()
+
+    def since(self, after_id):
+        with self._cond:
+            return [m for m in self._messages if m["id"] > after_id]
+
+    def wait(self, after_id, timeout):
+        # Blocks until a message newer than after_id is published or timeout seconds pass
+        with self._cond:
+            self._cond.wait_for(lambda: self.last_id > after_id, timeout)
+            return [m for m in self._messages if m["id"] > after_id]
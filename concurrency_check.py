@@ -0,0 +1,99 @@
+import argparse
+import logging
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import requests
+
+from database import connect
+from fake_cr_api import FakeApiServer
+from init_db import init_db
+
+BASE_DIR = Path(__file__).parent
+
+# Shows that serve_async.py overlaps upstream calls: N profiles nobody has fetched yet are
+# requested at once from a single-threaded gevent server while the fake API sleeps `latency`
+# seconds per call. Serially that is N * latency; overlapped it is about one latency.
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def seed_users(db_path, count):
+    conn = connect(db_path)
+    conn.executemany(
+        "INSERT INTO users (username, email, password_hash, cr_username, player_tag) VALUES (?, ?, '-', ?, ?)",
+        [(f"user{i}", f"user{i}@example.com", f"Player {i}", f"TAG{i}") for i in range(count)],
+    )
+    conn.commit()
+    conn.close()
+    return [f"TAG{i}" for i in range(count)]
+
+
+def wait_until_up(url, timeout=15):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            requests.get(url, timeout=1)
+            return
+        except requests.ConnectionError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Server at {url} didn't start")
+
+
+def check(count=50, latency=0.5, concurrency=200):
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)  # the fake API logs every call
+    with FakeApiServer(latency=latency) as upstream, tempfile.TemporaryDirectory() as tmp:
+        db_path = Path(tmp) / "users.db"
+        init_db(db_path)
+        tags = seed_users(db_path, count)
+        port = free_port()
+        env = dict(
+            os.environ,
+            DATABASE_PATH=str(db_path),
+            CR_API_BASE=upstream.base_url,
+            API_KEY="check",
+            APP_KEY="check",
+        )
+        server = subprocess.Popen(
+            [sys.executable, str(BASE_DIR / "serve_async.py"), "--host", "127.0.0.1", "--port", str(port),
+             "--concurrency", str(concurrency)],
+            env=env, stdout=subprocess.DEVNULL,
+        )
+        try:
+            base = f"http://127.0.0.1:{port}"
+            wait_until_up(f"{base}/leaderboard")
+
+            def fetch(tag):
+                return requests.get(f"{base}/profile/{tag}", timeout=60).status_code
+
+            start = time.perf_counter()
+            with ThreadPoolExecutor(count) as pool:
+                statuses = list(pool.map(fetch, tags))
+            elapsed = time.perf_counter() - start
+        finally:
+            server.terminate()
+            server.wait()
+    serial = count * latency
+    ok = statuses.count(200)
+    print(f"{ok}/{count} profiles in {elapsed:.2f}s on one server thread "
+          f"(serial would be {serial:.1f}s, {serial / elapsed:.0f}x overlap)")
+    return ok == count and elapsed < serial / 4
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check that serve_async.py overlaps Clash Royale API calls")
+    parser.add_argument("--requests", type=int, default=50, help="concurrent profile requests")
+    parser.add_argument("--latency", type=float, default=0.5, help="fake API delay per call in seconds")
+    parser.add_argument("--concurrency", type=int, default=200, help="serve_async.py --concurrency")
+    args = parser.parse_args()
+    raise SystemExit(0 if check(args.requests, args.latency, args.concurrency) else 1)
@@ -0,0 +1,155 @@
+import os
+import random
+import threading
+import time
+from urllib.parse import quote
+
+import requests
+from requests.adapters import HTTPAdapter
+
+API_BASE = "https://api.clashroyale.com/v1"
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+def get_api_key():
+    key = os.getenv("API_KEY")
+    if not key:
+        raise RuntimeError("not a valid api key for variable")
+    return key
+
+
+class CircuitOpenError(requests.RequestException):
+    # Raised without touching the network while the breaker is open
+    pass
+
+
+class CircuitBreaker:
+    # closed -> open after failure_threshold consecutive failures, open -> half-open after
+    # reset_timeout seconds, half-open lets one trial call through and closes on success.
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state()
+
+    def _state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def before_call(self):
+        with self._lock:
+            state = self._state()
+            if state == "open" or (state == "half-open" and self._trial_running):
+                raise CircuitOpenError("Clash Royale API circuit is open")
+            if state == "half-open":
+                self._trial_running = True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_running = False
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+
+class ClashRoyaleClient:
+    # Shared client for the Clash Royale API: one keep-alive Session with a connection pool,
+    # connect/read timeouts, jittered retries for transient errors and a circuit breaker.
+
+    def __init__(self, base_url=API_BASE, api_key=None, connect_timeout=3.05, read_timeout=5,
+                 retries=2, backoff=0.25, pool_size=10, breaker=None):
+        self.base_url = base_url.rstrip("/")
+        self.api_key = api_key
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.pool_size = pool_size
+        self.breaker = breaker or CircuitBreaker()
+        self._session = None
+        self._session_lock = threading.Lock()
+
+    @property
+    def session(self):
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                    session.mount("https://", adapter)
+                    session.mount("http://", adapter)
+                    session.headers["Authorization"] = f"Bearer {self.api_key or get_api_key()}"
+                    session.headers["Accept"] = "application/json"
+                    self._session = session
+        return self._session
+
+    def get(self, path):
+        self.breaker.before_call()
+        try:
+            response = self._get_with_retries(self.base_url + path)
+        except BaseException:
+            # Every way out without a response counts as a failure (including a missing API key
+            # or a body that broke off mid-read), so a half-open trial always finishes
+            self.breaker.record_failure()
+            raise
+        # A 4xx (e.g. unknown tag) means upstream is healthy, so it counts as a success
+        self.breaker.record_success()
+        response.raise_for_status()
+        return response.json()
+
+    def _get_with_retries(self, url):
+        attempt = 0
+        while True:
+            try:
+                response = self.session.get(url, timeout=self.timeout)
+                if response.status_code in RETRY_STATUSES:
+                    response.raise_for_status()
+                return response
+            except (requests.ConnectionError, requests.Timeout, requests.HTTPError):
+                if attempt >= self.retries:
+                    raise
+                attempt += 1
+                # Full jitter so a burst of failing workers doesn't retry in lockstep
+                time.sleep(random.uniform(0, self.backoff * (2 ** attempt)))
+
+    def get_player(self, player_tag):
+        return self.get(f"/players/{quote('#' + player_tag)}")
+
+    def get_battlelog(self, player_tag):
+        # The player's last 25 battles, newest first
+        return self.get(f"/players/{quote('#' + player_tag)}/battlelog")
+
+    def close(self):
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+
+
+def client_from_env():
+    return ClashRoyaleClient(
+        base_url=os.getenv("CR_API_BASE", API_BASE),
+        connect_timeout=float(os.getenv("CR_API_CONNECT_TIMEOUT", "3.05")),
+        read_timeout=float(os.getenv("CR_API_READ_TIMEOUT", "5")),
+        retries=int(os.getenv("CR_API_RETRIES", "2")),
+        pool_size=int(os.getenv("CR_API_POOL_SIZE", "10")),
+        breaker=CircuitBreaker(
+            failure_threshold=int(os.getenv("CR_API_BREAKER_FAILURES", "5")),
+            reset_timeout=float(os.getenv("CR_API_BREAKER_RESET", "30")),
+        ),
+    )
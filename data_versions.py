@@ -0,0 +1,62 @@
+import hashlib
+import threading
+from collections import defaultdict
+
+# Version counters for groups of rows that pages are built from ("announcements", "users",
+# "tournaments") or for one cached object ("tournament:7"). Every write that changes one bumps
+# its counter in the same transaction, so anything derived from the data (ETags, cached
+# fragments, view models) can be keyed on the counters and goes stale by itself, in every
+# process, the moment the data changes.
+
+BUMP_SQL = (
+    "INSERT INTO data_versions (name, version) VALUES (?, 1) "
+    "ON CONFLICT(name) DO UPDATE SET version = version + 1"
+)
+
+
+def bump(db, *names):
+    db.executemany(BUMP_SQL, [(name,) for name in names])
+
+
+def get_versions(db):
+    return {name: version for name, version in db.execute("SELECT name, version FROM data_versions")}
+
+
+def make_etag(*parts):
+    return hashlib.sha1(repr(parts).encode()).hexdigest()[:20]
+
+
+class Coherence:
+    # Drops in-process cache entries when another process (a mod_wsgi daemon, worker.py) bumps
+    # their counters. Each process remembers the counters it saw last; sync() compares them with
+    # the request's and calls the watchers of each one that moved. A counter "<namespace>:<key>"
+    # drops that key, a plain "<namespace>" the whole namespace. Entries are also keyed on the
+    # version they were built from, so a fill racing a sync can't bring a stale value back.
+
+    def __init__(self):
+        self._seen = None
+        self._watchers = defaultdict(list)
+        self._lock = threading.Lock()
+        self._stats = {"syncs": 0, "changes": 0}
+
+    def watch(self, namespace, callback):
+        # callback(key), key is None for the whole namespace
+        self._watchers[namespace].append(callback)
+
+    def sync(self, versions):
+        with self._lock:
+            seen, self._seen = self._seen, dict(versions)
+            self._stats["syncs"] += 1
+            if seen is None:  # first request, nothing cached yet
+                return []
+            changed = [name for name in versions.keys() | seen.keys() if versions.get(name) != seen.get(name)]
+            self._stats["changes"] += len(changed)
+        for name in changed:
+            namespace, _, key = name.partition(":")
+            for callback in self._watchers.get(namespace, ()):
+                callback(key or None)
+        return changed
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, counters=len(self._seen or ()))
@@ -0,0 +1,67 @@
+import sqlite3
+import threading
+
+# Applied to every connection we open. WAL lets readers run alongside the single writer,
+# busy_timeout makes a writer wait for the lock instead of failing with "database is locked".
+PRAGMAS = (
+    "PRAGMA busy_timeout = {busy_timeout}",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA foreign_keys = ON",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -{cache_kb}",
+)
+
+
+def connect(database, busy_timeout=5000, cache_kb=8192, cached_statements=256, check_same_thread=True,
+            factory=sqlite3.Connection):
+    conn = sqlite3.connect(
+        database,
+        timeout=busy_timeout / 1000,
+        cached_statements=cached_statements,
+        check_same_thread=check_same_thread,
+        factory=factory,
+    )
+    conn.row_factory = sqlite3.Row
+    # journal_mode is stored in the database file, but setting it again is a cheap no-op
+    conn.execute("PRAGMA journal_mode = WAL")
+    for pragma in PRAGMAS:
+        conn.execute(pragma.format(busy_timeout=int(busy_timeout), cache_kb=int(cache_kb)))
+    return conn
+
+
+class ConnectionPool:
+    # Long-lived connections checked out for the length of a request and handed back after.
+    # mod_wsgi threads and gevent greenlets alike get a warm connection from the idle list, so
+    # the connect + pragma cost is paid once per connection instead of once per request.
+
+    def __init__(self, database, max_idle=32, **options):
+        self.database = database
+        self.max_idle = max_idle
+        self.options = dict(options, check_same_thread=False)  # a connection moves between threads, one at a time
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        return connect(self.database, **self.options)
+
+    def release(self, conn):
+        # Never hand a half-finished transaction to the next request
+        if conn.in_transaction:
+            conn.rollback()
+        with self._lock:
+            if len(self._idle) < self.max_idle:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    def discard(self, conn):
+        conn.close()
+
+    def clear(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
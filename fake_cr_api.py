@@ -0,0 +1,120 @@
+"""Local stand-in for api.clashroyale.com so the app can be run and load-tested offline.
+
+Run it with `python fake_cr_api.py --latency 0.3` and start the app with
+CR_API_BASE=http://127.0.0.1:8001/v1 (any API_KEY value is accepted).
+"""
+import argparse
+import random
+import threading
+import time
+import zlib
+
+from flask import Flask, abort
+from werkzeug.serving import make_server
+
+CARDS = ["Knight", "Archers", "Fireball", "Hog Rider", "Musketeer", "Valkyrie", "Zap", "Goblin Barrel",
+         "Baby Dragon", "Giant", "Mini P.E.K.K.A", "Skeletons", "The Log", "Ice Spirit", "Cannon", "Arrows"]
+
+
+def fake_player(player_tag):
+    # Deterministic per tag so repeated runs render the same pages
+    rng = random.Random(zlib.crc32(player_tag.encode()))
+    trophies = rng.randint(3000, 9000)
+    return {
+        "tag": f"#{player_tag}",
+        "name": f"Player {player_tag[:6]}",
+        "trophies": trophies,
+        "bestTrophies": trophies + rng.randint(0, 800),
+        "clan": {"tag": "#UNHCRC", "name": "UNH CRC"},
+        "currentDeck": [{"name": name} for name in rng.sample(CARDS, 8)],
+    }
+
+
+def fake_battlelog(player_tag, now=None, interval=3600, club_size=500):
+    # The last 25 battles, newest first, one every `interval` seconds at a fixed phase per tag,
+    # so each call returns the same battles plus whatever has been "played" since. Opponents
+    # are seed_db.py style tags (B000000...), so club members meet each other.
+    now = time.time() if now is None else now
+    phase = zlib.crc32(player_tag.encode()) % interval
+    latest = int((now - phase) // interval)
+    battles = []
+    for slot in range(latest, latest - 25, -1):
+        rng = random.Random(f"{player_tag}:{slot}")
+        crowns, opponent_crowns = rng.choice([(1, 0), (2, 1), (3, 0), (0, 1), (1, 2), (0, 3), (1, 1)])
+        change = 30 if crowns > opponent_crowns else -30 if crowns < opponent_crowns else 0
+        battles.append({
+            "type": "PvP",
+            "battleTime": time.strftime("%Y%m%dT%H%M%S.000Z", time.gmtime(slot * interval + phase)),
+            "gameMode": {"id": 72000006, "name": "Ladder"},
+            "team": [{"tag": f"#{player_tag}", "name": f"Player {player_tag[:6]}", "crowns": crowns,
+                      "trophyChange": change}],
+            "opponent": [{"tag": f"#B{rng.randrange(club_size):06d}", "name": "Opponent", "crowns": opponent_crowns,
+                          "trophyChange": -change}],
+        })
+    return battles
+
+
+def create_app(latency=0.0, jitter=0.0, error_rate=0.0, unknown_prefix="BAD"):
+    app = Flask(__name__)
+    app.config.update(LATENCY=latency, JITTER=jitter, ERROR_RATE=error_rate)
+
+    def simulate_upstream():
+        delay = app.config["LATENCY"] + random.uniform(0, app.config["JITTER"])
+        if delay:
+            time.sleep(delay)
+        if random.random() < app.config["ERROR_RATE"]:
+            abort(503)
+
+    @app.route("/v1/players/<path:tag>")
+    def player(tag):
+        simulate_upstream()
+        player_tag = tag.lstrip("#").upper()
+        if player_tag.startswith(unknown_prefix):
+            return {"reason": "notFound"}, 404
+        return fake_player(player_tag)
+
+    @app.route("/v1/players/<path:tag>/battlelog")
+    def battlelog(tag):
+        simulate_upstream()
+        player_tag = tag.lstrip("#").upper()
+        if player_tag.startswith(unknown_prefix):
+            return {"reason": "notFound"}, 404
+        return fake_battlelog(player_tag)
+
+    return app
+
+
+class FakeApiServer:
+    # Runs the fake API on a background thread, e.g. inside a test or benchmark:
+    #     with FakeApiServer(latency=0.2) as server:
+    #         client = ClashRoyaleClient(base_url=server.base_url, api_key="test")
+
+    def __init__(self, host="127.0.0.1", port=0, **options):
+        self.app = create_app(**options)
+        self._server = make_server(host, port, self.app, threaded=True)
+        self.base_url = f"http://{host}:{self._server.server_port}/v1"
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fake Clash Royale API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency", type=float, default=0.0, help="base delay per request in seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="extra random delay up to this many seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests that return 503")
+    args = parser.parse_args()
+    create_app(args.latency, args.jitter, args.error_rate).run(host=args.host, port=args.port, threaded=True)
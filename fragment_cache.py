@@ -0,0 +1,48 @@
+import threading
+from collections import OrderedDict
+
+
+class FragmentCache:
+    # Small in-process LRU for view models and rendered template fragments, grouped into
+    # namespaces so a write can drop one key ("tournament", 7) or a whole namespace.
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # (namespace, key) -> value
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "invalidations": 0}
+
+    def get(self, namespace, key):
+        with self._lock:
+            value = self._entries.get((namespace, key))
+            if value is None:
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end((namespace, key))
+            self._stats["hits"] += 1
+            return value
+
+    def set(self, namespace, key, value):
+        with self._lock:
+            self._entries[(namespace, key)] = value
+            self._entries.move_to_end((namespace, key))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return value
+
+    def invalidate(self, namespace, key=None):
+        with self._lock:
+            self._stats["invalidations"] += 1
+            if key is not None:
+                self._entries.pop((namespace, key), None)
+                return
+            for entry in [k for k in self._entries if k[0] == namespace]:
+                del self._entries[entry]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, size=len(self._entries), max_entries=self.max_entries)
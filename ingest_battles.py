@@ -0,0 +1,47 @@
+import argparse
+import os
+import time
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+from battles import ingest_battlelogs
+from bulk_fetch import TokenBucket
+from cr_api import client_from_env
+from database import connect
+
+BASE_DIR = Path(__file__).parent
+DB_PATH = Path(os.getenv("DATABASE_PATH", BASE_DIR / "users.db"))
+
+
+def ingest_battles(min_interval=0, workers=8, rate=20.0, burst=None):
+    load_dotenv(BASE_DIR / ".env")
+    client = client_from_env()
+    client.pool_size = max(client.pool_size, workers)
+    conn = connect(DB_PATH)
+    try:
+        tags = [r[0] for r in conn.execute("SELECT player_tag FROM users")]
+        start = time.perf_counter()
+        fetched, inserted, errors = ingest_battlelogs(conn, tags, client.get_battlelog, workers,
+                                                      TokenBucket(rate, burst), min_interval)
+        elapsed = time.perf_counter() - start
+    finally:
+        conn.close()
+        client.close()
+    print(f"Fetched {fetched - len(errors)}/{fetched} battlelogs ({len(tags) - fetched} checked recently), "
+          f"{inserted} new battles in {elapsed:.1f}s")
+    for tag, error in sorted(errors.items()):
+        print(f"  #{tag}: {error}")
+    return errors
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pull new battles from every registered user's battlelog")
+    parser.add_argument("--min-interval", type=int, default=0,
+                        help="skip players whose battlelog was fetched less than this many seconds ago")
+    parser.add_argument("--workers", type=int, default=8, help="concurrent API requests")
+    parser.add_argument("--rate", type=float, default=float(os.getenv("CR_API_RATE", "20")), help="API requests per second")
+    parser.add_argument("--burst", type=int, default=None, help="requests allowed in a burst (defaults to --rate)")
+    args = parser.parse_args()
+    errors = ingest_battles(args.min_interval, args.workers, args.rate, args.burst)
+    raise SystemExit(1 if errors else 0)
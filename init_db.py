@@ -1,16 +1,23 @@
+import os
 import sqlite3
 from pathlib import Path
 
-DB_PATH = Path(__file__).parent / "users.db"
+from migrations import migrate
+
+DB_PATH = Path(os.getenv("DATABASE_PATH", Path(__file__).parent / "users.db"))
 SQL_FILE = Path(__file__).parent / "schema.sql"
 
-def init_db():
-    conn = sqlite3.connect(DB_PATH)
+def init_db(db_path=None):
+    db_path = db_path or DB_PATH
+    conn = sqlite3.connect(db_path)
     with open(SQL_FILE, "r", encoding="utf-8") as f:
         conn.executescript(f.read())
     conn.commit()
+    # Bring the new (or existing) database up to the latest schema version
+    for version, name in migrate(conn):
+        print(f"Applied migration {version}: {name}")
     conn.close()
-    print(f"Initialized DB at {DB_PATH}")
+    print(f"Initialized DB at {db_path}")
 
 if __name__ == "__main__":
     init_db()
@@ -0,0 +1,234 @@
+import json
+import logging
+import os
+import random
+import socket
+import threading
+import time
+import traceback
+
+from database import connect
+
+log = logging.getLogger(__name__)
+
+# Durable background jobs in the jobs table (migration 10). Routes enqueue() inside their own
+# transaction, so a job exists exactly when the write it belongs to commits. Workers claim
+# one job at a time under the write lock, which makes a claim atomic across processes. A
+# claimed job is leased: if its worker dies mid-job the lease runs out and another worker
+# takes it again, so work survives restarts. Failures retry with exponential backoff until
+# max_attempts, then the job is parked as 'dead' for an admin to look at.
+
+DEFAULT_MAX_ATTEMPTS = 5
+BACKOFF_BASE = 30  # seconds before the first retry, doubling after each failure
+BACKOFF_CAP = 3600
+DONE_RETENTION = 7 * 86400  # finished jobs kept this long, then purged
+PURGE_INTERVAL = 3600
+
+
+class PermanentJobError(Exception):
+    # Raised by a handler when retrying can't help (bad payload, an address the mail server
+    # rejected). The job goes straight to 'dead'.
+    pass
+
+
+def enqueue(db, kind, payload, delay=0, max_attempts=DEFAULT_MAX_ATTEMPTS, unique_key=None):
+    # Doesn't commit: the job is written with the caller's transaction. With a unique_key, a job
+    # with that key still queued or running makes this a no-op. Returns the id or None.
+    now = time.time()
+    cur = db.execute(
+        "INSERT OR IGNORE INTO jobs (kind, payload, run_at, max_attempts, unique_key, created_at) "
+        "VALUES (?, ?, ?, ?, ?, ?)",
+        (kind, json.dumps(payload), now + delay, max_attempts, unique_key, now),
+    )
+    return cur.lastrowid if cur.rowcount else None
+
+
+def enqueue_many(db, kind, payloads, delay=0, max_attempts=DEFAULT_MAX_ATTEMPTS):
+    # enqueue() for a batch of payloads in one executemany, e.g. an email per entrant
+    now = time.time()
+    db.executemany(
+        "INSERT INTO jobs (kind, payload, run_at, max_attempts, created_at) VALUES (?, ?, ?, ?, ?)",
+        [(kind, json.dumps(payload), now + delay, max_attempts, now) for payload in payloads],
+    )
+
+
+def backoff(attempts):
+    # Full jitter, so jobs that failed together (e.g. the mail server was down) don't all
+    # come back at the same moment
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** (attempts - 1)))
+
+
+def claim(db, worker_id, lease=300, limits=None):
+    # Takes the next due job (queued, or running with an expired lease) and marks it running
+    # for `lease` seconds. limits ({kind: n}) caps how many of a kind run at once across all
+    # workers. Returns the job row or None.
+    now = time.time()
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        full = []
+        if limits:
+            running = dict(db.execute(
+                "SELECT kind, COUNT(*) FROM jobs WHERE state = 'running' AND run_at > ? GROUP BY kind", (now,)
+            ).fetchall())
+            full = [kind for kind, limit in limits.items() if running.get(kind, 0) >= limit]
+        while True:
+            job = db.execute(f"""
+                SELECT * FROM jobs
+                WHERE state IN ('queued', 'running') AND run_at <= ?
+                  AND kind NOT IN ({", ".join("?" * len(full))})
+                ORDER BY run_at, id
+                LIMIT 1
+            """, (now, *full)).fetchone()
+            if job is None:
+                db.commit()
+                return None
+            if job["state"] == "running" and job["attempts"] >= job["max_attempts"]:
+                # Its worker died on the last attempt; don't run it again
+                db.execute(
+                    "UPDATE jobs SET state = 'dead', last_error = ?, finished_at = ?, locked_by = NULL WHERE id = ?",
+                    (f"lease expired on {job['locked_by']}", now, job["id"]),
+                )
+                continue
+            db.execute(
+                "UPDATE jobs SET state = 'running', attempts = attempts + 1, run_at = ?, locked_by = ? WHERE id = ?",
+                (now + lease, worker_id, job["id"]),
+            )
+            db.commit()
+            return db.execute("SELECT * FROM jobs WHERE id = ?", (job["id"],)).fetchone()
+    except BaseException:
+        db.rollback()
+        raise
+
+
+def complete(db, job):
+    # Commits whatever the handler wrote together with the job being marked done
+    db.execute(
+        "UPDATE jobs SET state = 'done', finished_at = ?, locked_by = NULL, last_error = NULL WHERE id = ?",
+        (time.time(), job["id"]),
+    )
+    db.commit()
+
+
+def fail(db, job, error, permanent=False):
+    now = time.time()
+    if permanent or job["attempts"] >= job["max_attempts"]:
+        db.execute(
+            "UPDATE jobs SET state = 'dead', last_error = ?, finished_at = ?, locked_by = NULL WHERE id = ?",
+            (error, now, job["id"]),
+        )
+    else:
+        db.execute(
+            "UPDATE jobs SET state = 'queued', last_error = ?, run_at = ?, locked_by = NULL WHERE id = ?",
+            (error, now + backoff(job["attempts"]), job["id"]),
+        )
+    db.commit()
+
+
+def retry(db, job_id):
+    # Puts a dead job back in the queue with a fresh set of attempts
+    cur = db.execute(
+        "UPDATE jobs SET state = 'queued', attempts = 0, run_at = ?, finished_at = NULL WHERE id = ? AND state = 'dead'",
+        (time.time(), job_id),
+    )
+    return cur.rowcount > 0
+
+
+def purge(db, older_than=DONE_RETENTION):
+    cur = db.execute("DELETE FROM jobs WHERE state = 'done' AND finished_at < ?", (time.time() - older_than,))
+    db.commit()
+    return cur.rowcount
+
+
+def stats(db, dead_limit=20):
+    now = time.time()
+    counts = {}
+    for kind, state, count in db.execute("SELECT kind, state, COUNT(*) FROM jobs GROUP BY kind, state"):
+        counts.setdefault(kind, {})[state] = count
+    oldest = db.execute(
+        "SELECT MIN(run_at) FROM jobs WHERE state = 'queued' AND run_at <= ?", (now,)
+    ).fetchone()[0]
+    dead = db.execute(
+        "SELECT id, kind, payload, attempts, last_error, finished_at FROM jobs WHERE state = 'dead' "
+        "ORDER BY finished_at DESC LIMIT ?", (dead_limit,)
+    ).fetchall()
+    return {
+        "counts": counts,
+        "oldest_due_seconds": round(now - oldest, 1) if oldest else 0,
+        "dead": [dict(row) for row in dead],
+    }
+
+
+class Worker:
+    # `concurrency` threads, each with its own connection, claiming and running jobs until
+    # stop(). handlers maps a job kind to fn(db, payload); whatever the handler writes with
+    # db is committed together with the job being marked done, or rolled back if it raises.
+    # A job that outlives its lease may be picked up by another worker, so keep handlers
+    # well under `lease` seconds and safe to run twice.
+
+    def __init__(self, database, handlers, concurrency=4, limits=None, lease=300, poll_interval=1.0):
+        self.database = database
+        self.handlers = handlers
+        self.concurrency = concurrency
+        self.limits = limits or {}
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self._stop = threading.Event()
+
+    def stop(self):
+        # Threads finish the job they're on and exit
+        self._stop.set()
+
+    def run(self, drain=False):
+        # Blocks until stop(); with drain=True returns once no job is due
+        threads = [threading.Thread(target=self._loop, args=(drain,), name=f"job-worker-{i}")
+                   for i in range(self.concurrency)]
+        for thread in threads:
+            thread.start()
+        log.info("Worker %s running %d threads", self.worker_id, self.concurrency)
+        conn = connect(self.database)
+        next_purge = 0
+        try:
+            while any(thread.is_alive() for thread in threads):
+                if time.monotonic() >= next_purge:
+                    purged = purge(conn)
+                    if purged:
+                        log.info("Purged %d finished jobs", purged)
+                    next_purge = time.monotonic() + PURGE_INTERVAL
+                self._stop.wait(1.0)
+        finally:
+            conn.close()
+
+    def _loop(self, drain):
+        conn = connect(self.database)
+        try:
+            while not self._stop.is_set():
+                job = claim(conn, self.worker_id, self.lease, self.limits)
+                if job is None:
+                    if drain:
+                        return
+                    self._stop.wait(self.poll_interval)
+                    continue
+                self.run_job(conn, job)
+        finally:
+            conn.close()
+
+    def run_job(self, conn, job):
+        start = time.perf_counter()
+        try:
+            handler = self.handlers.get(job["kind"])
+            if handler is None:
+                raise PermanentJobError(f"no handler for job kind {job['kind']!r}")
+            handler(conn, json.loads(job["payload"]))
+        except PermanentJobError as e:
+            conn.rollback()
+            log.error("Job %s (%s) failed permanently: %s", job["id"], job["kind"], e)
+            fail(conn, job, str(e), permanent=True)
+        except Exception as e:
+            conn.rollback()
+            log.warning("Job %s (%s) attempt %d/%d failed: %s", job["id"], job["kind"],
+                        job["attempts"], job["max_attempts"], e)
+            fail(conn, job, "".join(traceback.format_exception_only(e)).strip())
+        else:
+            complete(conn, job)
+            log.info("Job %s (%s) done in %.0fms", job["id"], job["kind"], (time.perf_counter() - start) * 1000)
@@ -0,0 +1,57 @@
+import logging
+import os
+import smtplib
+from email.message import EmailMessage
+
+log = logging.getLogger(__name__)
+
+# Email backends for the send_email job. Anything with send(to, subject, body) will do.
+# For local development, point the SMTP backend at a stand-in that prints what it receives:
+#   python -m aiosmtpd -n -l localhost:1025
+#   MAIL_BACKEND=smtp SMTP_HOST=localhost SMTP_PORT=1025 python worker.py
+
+
+class ConsoleMailer:
+    # Logs messages instead of sending them (the default when nothing is configured)
+
+    def send(self, to, subject, body):
+        log.info("Email to %s: %s\n%s", to, subject, body)
+
+
+class SmtpMailer:
+    def __init__(self, host, port=25, sender="noreply@localhost", username=None, password=None,
+                 starttls=False, timeout=10):
+        self.host = host
+        self.port = port
+        self.sender = sender
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.timeout = timeout
+
+    def send(self, to, subject, body):
+        message = EmailMessage()
+        message["From"] = self.sender
+        message["To"] = to
+        message["Subject"] = subject
+        message.set_content(body)
+        # A new connection per message: the worker sends a handful of emails, not bulk mail
+        with smtplib.SMTP(self.host, self.port, timeout=self.timeout) as smtp:
+            if self.starttls:
+                smtp.starttls()
+            if self.username:
+                smtp.login(self.username, self.password)
+            smtp.send_message(message)
+
+
+def mailer_from_env():
+    if os.getenv("MAIL_BACKEND", "console") == "smtp":
+        return SmtpMailer(
+            host=os.getenv("SMTP_HOST", "localhost"),
+            port=int(os.getenv("SMTP_PORT", "25")),
+            sender=os.getenv("MAIL_FROM", "noreply@localhost"),
+            username=os.getenv("SMTP_USERNAME"),
+            password=os.getenv("SMTP_PASSWORD"),
+            starttls=os.getenv("SMTP_STARTTLS") == "1",
+        )
+    return ConsoleMailer()
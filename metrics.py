@@ -0,0 +1,180 @@
+import sqlite3
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import g, has_request_context, request
+from flask.signals import before_render_template, template_rendered
+
+# Upper bounds in seconds, Prometheus style (le="..."), plus the implicit +Inf
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Where a request's time can go; anything left over is Python in the view itself
+COMPONENTS = ("db", "api", "password", "render")
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def record(component, seconds, count=1):
+    # Adds time to the current request's breakdown; calls outside a request (background
+    # snapshot refreshes, the CLI tools) aren't part of any page and are ignored
+    if has_request_context():
+        timings = g.setdefault("timings", defaultdict(float))
+        timings[component] += seconds
+        counts = g.setdefault("timing_counts", defaultdict(int))
+        counts[component] += count
+
+
+@contextmanager
+def timed(component):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(component, time.perf_counter() - start)
+
+
+def wrap(component, fn):
+    @wraps(fn)
+    def wrapped(*args, **kwargs):
+        with timed(component):
+            return fn(*args, **kwargs)
+    return wrapped
+
+
+class TimedConnection(sqlite3.Connection):
+    # Connection factory for database.connect that counts statements towards "db". Rows fetched
+    # after the first step aren't included, but for our queries nearly all the work (index
+    # seeks, sorts, aggregates) happens before the first row comes back.
+
+    def execute(self, *args):
+        start = time.perf_counter()
+        try:
+            return super().execute(*args)
+        finally:
+            record("db", time.perf_counter() - start)
+
+    def executemany(self, *args):
+        start = time.perf_counter()
+        try:
+            return super().executemany(*args)
+        finally:
+            record("db", time.perf_counter() - start)
+
+    def commit(self):
+        start = time.perf_counter()
+        try:
+            return super().commit()
+        finally:
+            record("db", time.perf_counter() - start, count=0)
+
+
+class RequestMetrics:
+    # Per-route request and component histograms, exported in Prometheus text format, plus a
+    # Server-Timing header on every response so the browser's network panel shows the split.
+    # Each app process keeps its own numbers, like any in-process Prometheus client would.
+
+    def __init__(self, app=None, server_timing=True):
+        self.server_timing = server_timing
+        self._lock = threading.Lock()
+        self._durations = defaultdict(Histogram)  # route -> whole request
+        self._components = defaultdict(Histogram)  # (route, component) -> time per request
+        self._requests = defaultdict(int)  # (route, status) -> count
+        self._queries = defaultdict(int)  # route -> db statements
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.before_request(self._start)
+        app.after_request(self._finish)
+        before_render_template.connect(self._render_started, app)
+        template_rendered.connect(self._render_finished, app)
+
+    def _start(self):
+        g.request_started = time.perf_counter()
+
+    def _render_started(self, sender, template, context, **extra):
+        g.setdefault("render_started", []).append(time.perf_counter())
+
+    def _render_finished(self, sender, template, context, **extra):
+        started = g.get("render_started")
+        if started:
+            start = started.pop()
+            if not started:  # nested renders are already inside the outer one
+                record("render", time.perf_counter() - start)
+
+    def _finish(self, response):
+        started = g.get("request_started")
+        if started is None:
+            return response
+        total = time.perf_counter() - started
+        timings = g.get("timings", {})
+        counts = g.get("timing_counts", {})
+        route = request.endpoint or "unmatched"
+        with self._lock:
+            self._durations[route].observe(total)
+            for component in COMPONENTS:
+                self._components[(route, component)].observe(timings.get(component, 0.0))
+            self._requests[(route, response.status_code)] += 1
+            self._queries[route] += counts.get("db", 0)
+        if self.server_timing:
+            parts = []
+            for component in COMPONENTS:
+                if component in timings:
+                    part = f"{component};dur={timings[component] * 1000:.1f}"
+                    if component == "db":
+                        queries = counts.get("db", 0)
+                        part += f';desc="{queries} {"query" if queries == 1 else "queries"}"'
+                    parts.append(part)
+            parts.append(f"total;dur={total * 1000:.1f}")
+            response.headers["Server-Timing"] = ", ".join(parts)
+        return response
+
+    def render(self):
+        # Prometheus text exposition format 0.0.4
+        lines = []
+        with self._lock:
+            lines += ["# HELP app_request_duration_seconds Time to produce the response, by route.",
+                      "# TYPE app_request_duration_seconds histogram"]
+            for route, hist in sorted(self._durations.items()):
+                lines += _histogram_lines("app_request_duration_seconds", f'route="{route}"', hist)
+            lines += ["# HELP app_request_component_seconds Time per request spent in db, api, password or render.",
+                      "# TYPE app_request_component_seconds histogram"]
+            for (route, component), hist in sorted(self._components.items()):
+                lines += _histogram_lines("app_request_component_seconds",
+                                          f'route="{route}",component="{component}"', hist)
+            lines += ["# HELP app_requests_total Responses sent, by route and status.",
+                      "# TYPE app_requests_total counter"]
+            for (route, status), count in sorted(self._requests.items()):
+                lines.append(f'app_requests_total{{route="{route}",status="{status}"}} {count}')
+            lines += ["# HELP app_db_queries_total SQL statements executed, by route.",
+                      "# TYPE app_db_queries_total counter"]
+            for route, count in sorted(self._queries.items()):
+                lines.append(f'app_db_queries_total{{route="{route}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+
+def _histogram_lines(name, labels, hist):
+    lines = []
+    cumulative = 0
+    for bound, count in zip(hist.buckets, hist.counts):
+        cumulative += count
+        lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+    lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {hist.count}')
+    lines.append(f"{name}_sum{{{labels}}} {hist.sum:.6f}")
+    lines.append(f"{name}_count{{{labels}}} {hist.count}")
+    return lines
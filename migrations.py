@@ -0,0 +1,207 @@
+import os
+import sqlite3
+from pathlib import Path
+
+from database import connect
+
+DB_PATH = Path(os.getenv("DATABASE_PATH", Path(__file__).parent / "users.db"))
+
+
+def fts_sync(table, columns):
+    # Triggers that keep the external content FTS5 table <table>_fts in step with <table>, then
+    # a rebuild to index the rows already there. An external content index has to be given the
+    # old values to remove them, hence the 'delete' commands.
+    cols = ", ".join(columns)
+    new = ", ".join(f"new.{c}" for c in columns)
+    old = ", ".join(f"old.{c}" for c in columns)
+    fts = f"{table}_fts"
+    return [
+        f"""CREATE TRIGGER IF NOT EXISTS {fts}_insert AFTER INSERT ON {table} BEGIN
+            INSERT INTO {fts} (rowid, {cols}) VALUES (new.id, {new});
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {fts}_delete AFTER DELETE ON {table} BEGIN
+            INSERT INTO {fts} ({fts}, rowid, {cols}) VALUES ('delete', old.id, {old});
+        END""",
+        # UPDATE OF: points changes on users don't touch the index
+        f"""CREATE TRIGGER IF NOT EXISTS {fts}_update AFTER UPDATE OF {cols} ON {table} BEGIN
+            INSERT INTO {fts} ({fts}, rowid, {cols}) VALUES ('delete', old.id, {old});
+            INSERT INTO {fts} (rowid, {cols}) VALUES (new.id, {new});
+        END""",
+        f"INSERT INTO {fts} ({fts}) VALUES ('rebuild')",
+    ]
+
+
+# Ordered schema changes applied on top of schema.sql. The database's PRAGMA user_version
+# records the last one applied, so append new migrations here and never edit old ones.
+MIGRATIONS = [
+    (1, "player snapshots", [
+        """CREATE TABLE IF NOT EXISTS player_snapshots (
+            player_tag TEXT PRIMARY KEY,
+            data TEXT NOT NULL,
+            fetched_at REAL NOT NULL
+        )""",
+    ]),
+    (2, "hot path indexes", [
+        "CREATE INDEX IF NOT EXISTS idx_users_points ON users(points DESC, id)",
+        "CREATE INDEX IF NOT EXISTS idx_announcements_created_at ON announcements(created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_chat_messages_created_at ON chat_messages(created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_participants_tournament_user ON participants(tournament_id, user_id)",
+        "CREATE INDEX IF NOT EXISTS idx_participants_user ON participants(user_id)",
+        "CREATE INDEX IF NOT EXISTS idx_matches_tournament_round ON matches(tournament_id, round, id)",
+        "ANALYZE",
+    ]),
+    (3, "chat keyset index", [
+        "DROP INDEX IF EXISTS idx_chat_messages_created_at",
+        "CREATE INDEX IF NOT EXISTS idx_chat_messages_created_at_id ON chat_messages(created_at, id)",
+    ]),
+    (4, "rate limits", [
+        """CREATE TABLE IF NOT EXISTS rate_limits (
+            key TEXT PRIMARY KEY,
+            tokens REAL NOT NULL,
+            updated_at REAL NOT NULL
+        ) WITHOUT ROWID""",
+    ]),
+    (5, "bracket positions", [
+        "ALTER TABLE matches ADD COLUMN position INTEGER",
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_matches_slot ON matches(tournament_id, round, position)",
+    ]),
+    (6, "tournament results", [
+        "ALTER TABLE tournaments ADD COLUMN ended_at DATETIME",
+        """CREATE TABLE IF NOT EXISTS tournament_results (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            tournament_id INTEGER NOT NULL REFERENCES tournaments(id) ON DELETE CASCADE,
+            user_id INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            place INTEGER NOT NULL,
+            points INTEGER NOT NULL
+        )""",
+        "CREATE INDEX IF NOT EXISTS idx_tournament_results_tournament ON tournament_results(tournament_id, place)",
+    ]),
+    (7, "data versions", [
+        """CREATE TABLE IF NOT EXISTS data_versions (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL
+        ) WITHOUT ROWID""",
+    ]),
+    (8, "chat author index", [
+        # Deleting a user cascades to chat_messages, which scanned the whole table without this
+        "CREATE INDEX IF NOT EXISTS idx_chat_messages_user ON chat_messages(user_id)",
+    ]),
+    (9, "full text search", [
+        """CREATE VIRTUAL TABLE IF NOT EXISTS announcements_fts USING fts5(
+            announcement, content='announcements', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+        )""",
+        *fts_sync("announcements", ["announcement"]),
+        """CREATE VIRTUAL TABLE IF NOT EXISTS chat_messages_fts USING fts5(
+            message, content='chat_messages', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+        )""",
+        *fts_sync("chat_messages", ["message"]),
+        # Prefix indexes so member autocomplete ("kni*") is a lookup rather than a term scan
+        """CREATE VIRTUAL TABLE IF NOT EXISTS users_fts USING fts5(
+            username, cr_username, player_tag, content='users', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2', prefix='1 2 3'
+        )""",
+        *fts_sync("users", ["username", "cr_username", "player_tag"]),
+    ]),
+    (10, "background jobs", [
+        # run_at is when a queued job is due, and for a running one when its lease runs out
+        """CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            state TEXT NOT NULL DEFAULT 'queued',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            max_attempts INTEGER NOT NULL,
+            run_at REAL NOT NULL,
+            unique_key TEXT,
+            locked_by TEXT,
+            last_error TEXT,
+            created_at REAL NOT NULL,
+            finished_at REAL
+        )""",
+        "CREATE INDEX IF NOT EXISTS idx_jobs_due ON jobs(run_at) WHERE state IN ('queued', 'running')",
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_jobs_unique ON jobs(unique_key) WHERE state IN ('queued', 'running')",
+        "CREATE INDEX IF NOT EXISTS idx_jobs_finished ON jobs(finished_at) WHERE state = 'done'",
+    ]),
+    (11, "email verification", [
+        "ALTER TABLE users ADD COLUMN email_verified_at DATETIME",
+    ]),
+    (12, "battles", [
+        # One row per battle. The sides are stored in a fixed order (side 0 has the smaller
+        # first tag), so a battle ingested from both players' logs has the same natural key.
+        """CREATE TABLE IF NOT EXISTS battles (
+            id INTEGER PRIMARY KEY,
+            battle_time TEXT NOT NULL,
+            side0_tags TEXT NOT NULL,
+            side1_tags TEXT NOT NULL,
+            side0_crowns INTEGER NOT NULL,
+            side1_crowns INTEGER NOT NULL,
+            type TEXT NOT NULL,
+            game_mode TEXT,
+            UNIQUE (battle_time, side0_tags, side1_tags)
+        )""",
+        # One row per player per battle, clustered by player for win rates and head-to-heads.
+        # won is 1 or 0, NULL for a draw.
+        """CREATE TABLE IF NOT EXISTS battle_players (
+            player_tag TEXT NOT NULL,
+            battle_id INTEGER NOT NULL REFERENCES battles(id) ON DELETE CASCADE,
+            side INTEGER NOT NULL,
+            won INTEGER,
+            trophy_change INTEGER,
+            PRIMARY KEY (player_tag, battle_id)
+        ) WITHOUT ROWID""",
+        "CREATE INDEX IF NOT EXISTS idx_battle_players_battle ON battle_players(battle_id)",
+        # Newest battle_time ingested per player; older battles in a log are skipped
+        """CREATE TABLE IF NOT EXISTS battle_cursors (
+            player_tag TEXT PRIMARY KEY,
+            last_battle_time TEXT,
+            checked_at REAL NOT NULL
+        ) WITHOUT ROWID""",
+    ]),
+]
+
+
+def current_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn, target=None):
+    # Applies each pending migration in its own write transaction and returns the ones applied.
+    # BEGIN IMMEDIATE takes the write lock up front, so two processes can't apply the same step.
+    applied = []
+    for version, name, statements in MIGRATIONS:
+        if target is not None and version > target:
+            break
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if current_version(conn) >= version:
+                conn.rollback()
+                continue
+            for statement in statements:
+                if callable(statement):
+                    statement(conn)
+                else:
+                    conn.execute(statement)
+            conn.execute(f"PRAGMA user_version = {int(version)}")
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+        applied.append((version, name))
+    return applied
+
+
+def pending(conn):
+    version = current_version(conn)
+    return [(v, name) for v, name, _ in MIGRATIONS if v > version]
+
+
+if __name__ == "__main__":
+    conn = connect(DB_PATH)
+    try:
+        before = current_version(conn)
+        for version, name in migrate(conn):
+            print(f"Applied migration {version}: {name}")
+        print(f"Database at version {current_version(conn)} (was {before})")
+    finally:
+        conn.close()
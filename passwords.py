@@ -0,0 +1,168 @@
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+log = logging.getLogger(__name__)
+
+
+class PasswordServiceBusy(Exception):
+    # Too many hashes queued (or one took too long); the caller should ask the user to retry
+    pass
+
+
+def _hash(password, method):
+    return generate_password_hash(password, method)
+
+
+def _verify(pwhash, password, method, prefix):
+    # Runs in a worker: check the password and, if it was stored with other cost parameters,
+    # hash it again with the current ones in the same round trip
+    if not check_password_hash(pwhash, password):
+        return False, None
+    if pwhash.split("$", 1)[0] != prefix:
+        return True, generate_password_hash(password, method)
+    return True, None
+
+
+class PasswordService:
+    # Password hashing is deliberately slow (scrypt ~50ms of CPU each), so it runs in a small
+    # process pool instead of the WSGI thread's process. At most `max_pending` hashes are
+    # queued or running per app process; past that new ones are refused straight away rather
+    # than piling up behind a login storm while every other route waits for the GIL.
+    # method is werkzeug's method string, e.g. "scrypt:32768:8:1" or "pbkdf2:sha256:600000".
+    # workers=0 hashes inline, for development or hosts that can't fork. `executor` replaces
+    # the process pool with any concurrent.futures-style executor. The pool starts from a
+    # forkserver rather than fork(): forking the multithreaded WSGI process would copy locks
+    # other threads hold into the children. Children run `python` (default sys.executable).
+    # If the pool breaks max_failures times in a row (children that can't start, e.g. a wrong
+    # interpreter), it is given up on and hashing stays inline, still bounded by max_pending.
+
+    def __init__(self, method="scrypt", workers=2, max_pending=8, timeout=10.0, start_method="forkserver", executor=None,
+                 python=None, max_failures=3):
+        self.method = method
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.start_method = start_method
+        self.python = python
+        self.max_failures = max_failures
+        self._failures = 0
+        self._broken = False
+        self._prefix = None
+        self._pool = executor
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._stats = {"hashed": 0, "verified": 0, "rehashed": 0, "rejected": 0}
+
+    @property
+    def prefix(self):
+        # Method and cost parameters exactly as they appear at the start of a new hash
+        if self._prefix is None:
+            self._prefix = generate_password_hash("", self.method).split("$", 1)[0]
+        return self._prefix
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                context = multiprocessing.get_context(self.start_method)
+                if self.python:
+                    context.set_executable(self.python)
+                self._pool = ProcessPoolExecutor(self.workers, mp_context=context)
+            return self._pool
+
+    def _pool_broke(self, error):
+        # A worker died (OOM killer, ...) or children can't start at all. The first failure is
+        # logged and a fresh pool tried next time; after max_failures in a row, stay inline.
+        with self._lock:
+            self._pool = None
+            self._failures += 1
+            if self._failures == 1:
+                log.warning("Password process pool broke (%s), hashing this one inline", error)
+            if self._failures >= self.max_failures and not self._broken:
+                self._broken = True
+                log.error("Password process pool broke %d times in a row, hashing inline from now on "
+                          "(check PASSWORD_POOL_PYTHON, or set PASSWORD_WORKERS=0)", self._failures)
+
+    def _run(self, fn, *args):
+        if self.workers <= 0:
+            return fn(*args)
+        if not self._slots.acquire(blocking=False):
+            self._stats["rejected"] += 1
+            raise PasswordServiceBusy("Password service is saturated")
+        if self._broken:
+            try:
+                return fn(*args)
+            finally:
+                self._slots.release()
+        try:
+            future = self._get_pool().submit(fn, *args)
+        except BrokenProcessPool as e:
+            self._slots.release()
+            self._pool_broke(e)
+            return fn(*args)
+        except BaseException:
+            self._slots.release()
+            raise
+        # The slot frees when the work does, not when we stop waiting, so the limit stays honest
+        future.add_done_callback(lambda f: self._slots.release())
+        try:
+            result = future.result(self.timeout)
+        except FutureTimeout:
+            self._stats["rejected"] += 1
+            raise PasswordServiceBusy("Password hashing timed out")
+        except BrokenProcessPool as e:
+            self._pool_broke(e)
+            return fn(*args)
+        self._failures = 0
+        return result
+
+    def hash(self, password):
+        self._stats["hashed"] += 1
+        return self._run(_hash, password, self.method)
+
+    def verify(self, pwhash, password):
+        # Returns (ok, new_hash); new_hash is set when the stored hash used old parameters
+        # and should be saved in its place
+        self._stats["verified"] += 1
+        ok, new_hash = self._run(_verify, pwhash, password, self.method, self.prefix)
+        if new_hash:
+            self._stats["rehashed"] += 1
+        return ok, new_hash
+
+    def stats(self):
+        return dict(self._stats, method=self.prefix, workers=self.workers, max_pending=self.max_pending,
+                    pool="inline" if self.workers <= 0 or self._broken else "process", pool_failures=self._failures)
+
+    def close(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+
+
+def embedded_in_mod_wsgi():
+    # Inside Apache, sys.executable is httpd, so pool children need PASSWORD_POOL_PYTHON
+    try:
+        import mod_wsgi
+    except ImportError:
+        return False
+    return hasattr(mod_wsgi, "process_group")  # the pip mod_wsgi-express package doesn't have it
+
+
+def service_from_env():
+    python = os.getenv("PASSWORD_POOL_PYTHON")
+    # No pool by default where the children can't be started right
+    default_workers = "0" if embedded_in_mod_wsgi() and not python else "2"
+    return PasswordService(
+        method=os.getenv("PASSWORD_HASH_METHOD", "scrypt"),
+        workers=int(os.getenv("PASSWORD_WORKERS", default_workers)),
+        max_pending=int(os.getenv("PASSWORD_MAX_PENDING", "8")),
+        timeout=float(os.getenv("PASSWORD_TIMEOUT", "10")),
+        start_method=os.getenv("PASSWORD_POOL_START_METHOD", "forkserver"),
+        python=python,
+    )
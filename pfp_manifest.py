@@ -0,0 +1,46 @@
+import threading
+from pathlib import Path
+
+PFP_SUFFIXES = (".webp", ".png")
+
+
+class PfpManifest:
+    # Profile picture names in static/pfp for the profile_edit dropdown and for validating the
+    # chosen one. The directory is listed once and again only when its mtime changes (a file
+    # was added, removed or renamed), so requests just pay for one stat().
+    # `classes` is the sprite atlas class map from build_assets.py: name -> CSS class.
+
+    def __init__(self, pfp_dir, classes=None):
+        self.pfp_dir = Path(pfp_dir)
+        self.classes = classes or {}
+        self._mtime = None
+        self._names = []
+        self._name_set = frozenset()
+        self._lock = threading.Lock()
+
+    def _refresh(self):
+        try:
+            mtime = self.pfp_dir.stat().st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if mtime == self._mtime:
+            return
+        with self._lock:
+            if mtime == self._mtime:
+                return
+            names = []
+            if mtime is not None:
+                names = sorted(f.stem for f in self.pfp_dir.iterdir() if f.suffix in PFP_SUFFIXES)
+            self._names, self._name_set, self._mtime = names, frozenset(names), mtime
+
+    def names(self):
+        self._refresh()
+        return self._names
+
+    def __contains__(self, name):
+        self._refresh()
+        return name in self._name_set
+
+    def css_class(self, name):
+        # None for pictures added after the last build, templates fall back to an <img>
+        return self.classes.get(name)
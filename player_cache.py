@@ -0,0 +1,118 @@
+import threading
+import time
+from collections import OrderedDict
+
+import requests
+
+
+class PlayerNotFound(requests.RequestException):
+    # Raised for tags the Clash Royale API said don't exist (cached as a negative entry)
+    pass
+
+
+class PlayerCache:
+    # In-memory TTL + LRU cache of Clash Royale player responses, keyed by player tag.
+    # Entries younger than ttl are served as-is, entries between ttl and stale_ttl are
+    # served immediately while a background thread refreshes them (stale-while-revalidate),
+    # and anything older is fetched again inline. Unknown tags are remembered for negative_ttl.
+
+    def __init__(self, fetch, ttl=300, stale_ttl=3600, negative_ttl=600, max_size=512):
+        self.fetch = fetch
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.negative_ttl = negative_ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()  # tag -> (data, fetched_at); data is None for unknown tags
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "stale": 0, "negative_hits": 0,
+                       "refreshes": 0, "refresh_errors": 0, "evictions": 0}
+
+    def get(self, tag):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(tag)
+            if entry is not None:
+                self._entries.move_to_end(tag)
+                data, fetched_at = entry
+                age = now - fetched_at
+                if data is None:
+                    if age < self.negative_ttl:
+                        self._stats["negative_hits"] += 1
+                        raise PlayerNotFound(f"unknown player tag {tag}")
+                elif age < self.ttl:
+                    self._stats["hits"] += 1
+                    return data
+                elif age < self.stale_ttl:
+                    self._stats["stale"] += 1
+                    if tag not in self._refreshing:
+                        self._refreshing.add(tag)
+                        threading.Thread(target=self._refresh, args=(tag,), daemon=True).start()
+                    return data
+            self._stats["misses"] += 1
+        return self._load(tag, entry)
+
+    def put(self, tag, data):
+        with self._lock:
+            self._store(tag, data)
+
+    def invalidate(self, tag):
+        with self._lock:
+            self._entries.pop(tag, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["size"] = len(self._entries)
+        lookups = stats["hits"] + stats["stale"] + stats["negative_hits"] + stats["misses"]
+        stats["hit_ratio"] = round((lookups - stats["misses"]) / lookups, 3) if lookups else 0.0
+        stats.update(ttl=self.ttl, stale_ttl=self.stale_ttl, negative_ttl=self.negative_ttl, max_size=self.max_size)
+        return stats
+
+    def _load(self, tag, previous=None):
+        try:
+            data = self.fetch(tag)
+        except requests.HTTPError as e:
+            if e.response is not None and e.response.status_code == 404:
+                with self._lock:
+                    self._store(tag, None)
+                raise PlayerNotFound(f"unknown player tag {tag}") from e
+            return self._fallback(tag, previous, e)
+        except requests.RequestException as e:
+            return self._fallback(tag, previous, e)
+        with self._lock:
+            self._store(tag, data)
+        return data
+
+    def _fallback(self, tag, previous, error):
+        # Upstream failed, serve whatever we last saw for this tag rather than nothing
+        if previous is not None and previous[0] is not None:
+            with self._lock:
+                self._stats["stale"] += 1
+            return previous[0]
+        raise error
+
+    def _refresh(self, tag):
+        try:
+            data = self.fetch(tag)
+        except requests.RequestException:
+            with self._lock:
+                self._stats["refresh_errors"] += 1
+        else:
+            with self._lock:
+                self._stats["refreshes"] += 1
+                self._store(tag, data)
+        finally:
+            with self._lock:
+                self._refreshing.discard(tag)
+
+    def _store(self, tag, data):
+        self._entries[tag] = (data, time.monotonic())
+        self._entries.move_to_end(tag)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self._stats["evictions"] += 1
@@ -0,0 +1,189 @@
+import logging
+import re
+import sqlite3
+import threading
+import time
+from collections import Counter, deque
+from functools import lru_cache
+
+from flask import g, has_request_context, request
+
+import metrics
+
+log = logging.getLogger(__name__)
+
+STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+IN_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+WHITESPACE = re.compile(r"\s+")
+
+
+@lru_cache(maxsize=1024)
+def normalize(sql):
+    # One shape per query: literals become ?, IN (?, ?, ...) becomes IN (...), whitespace collapses
+    sql = STRING_LITERAL.sub("?", sql)
+    sql = NUMBER_LITERAL.sub("?", sql)
+    sql = IN_LIST.sub("(...)", sql)
+    return WHITESPACE.sub(" ", sql).strip()
+
+
+def _statements():
+    return g.setdefault("statements", []) if has_request_context() else None
+
+
+class ProfiledCursor(sqlite3.Cursor):
+    # Records each statement as [normalized sql, sql, params, seconds, rows] on the request.
+    # Time and rows keep adding up while the caller fetches, so a lazy SELECT gets its full cost.
+
+    _record = None
+
+    def execute(self, sql, params=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, params)
+        finally:
+            self._start_record(sql, params, time.perf_counter() - start)
+
+    def executemany(self, sql, seq_of_params):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_params)
+        finally:
+            self._start_record(sql, None, time.perf_counter() - start)
+
+    def _start_record(self, sql, params, seconds):
+        metrics.record("db", seconds)
+        statements = _statements()
+        if statements is not None:
+            self._record = [normalize(sql), sql, params, seconds, max(self.rowcount, 0)]
+            statements.append(self._record)
+
+    def _fetched(self, start, rows):
+        seconds = time.perf_counter() - start
+        metrics.record("db", seconds, count=0)
+        if self._record is not None:
+            self._record[3] += seconds
+            self._record[4] += rows
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = super().fetchone()
+        self._fetched(start, row is not None)
+        return row
+
+    def fetchmany(self, size=None):
+        start = time.perf_counter()
+        rows = super().fetchmany(size if size is not None else self.arraysize)
+        self._fetched(start, len(rows))
+        return rows
+
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = super().fetchall()
+        self._fetched(start, len(rows))
+        return rows
+
+    def __next__(self):
+        start = time.perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self._fetched(start, 0)
+            raise
+        self._fetched(start, 1)
+        return row
+
+
+class ProfiledConnection(metrics.TimedConnection):
+    # Connection factory for the request pool: every statement goes through a ProfiledCursor
+
+    def execute(self, sql, params=()):
+        return self.cursor(ProfiledCursor).execute(sql, params)
+
+    def executemany(self, sql, seq_of_params):
+        return self.cursor(ProfiledCursor).executemany(sql, seq_of_params)
+
+
+class QueryProfiler:
+    # Checks each request's statements against a budget (statement count, total SQL time),
+    # flags the same statement shape repeating `repeat_limit` times (an N+1 loop), and runs
+    # EXPLAIN QUERY PLAN once per slow statement shape to spot full table scans. Problems are
+    # logged and the latest few are kept for the admin JSON endpoint.
+
+    def __init__(self, app=None, max_queries=20, max_ms=100, slow_ms=20, repeat_limit=5, keep=50):
+        self.max_queries = max_queries
+        self.max_ms = max_ms
+        self.slow_ms = slow_ms
+        self.repeat_limit = repeat_limit
+        self._flagged = deque(maxlen=keep)
+        self._plans = {}  # normalized sql -> {"plan": [...], "full_scan": bool, "max_ms": float}
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.after_request(self._check)
+
+    def _check(self, response):
+        statements = g.get("statements")
+        if not statements:
+            return response
+        total_ms = sum(s[3] for s in statements) * 1000
+        repeated = {sql: n for sql, n in Counter(s[0] for s in statements).items() if n >= self.repeat_limit}
+        slow = [s for s in statements if s[3] * 1000 >= self.slow_ms]
+        for statement in slow:
+            self._explain(statement)
+        problems = []
+        if len(statements) > self.max_queries:
+            problems.append(f"{len(statements)} statements (budget {self.max_queries})")
+        if total_ms > self.max_ms:
+            problems.append(f"{total_ms:.1f}ms of SQL (budget {self.max_ms}ms)")
+        problems += [f"repeated {n}x: {sql}" for sql, n in repeated.items()]
+        problems += [f"full scan ({s[3] * 1000:.1f}ms): {s[0]}" for s in slow if self._plans.get(s[0], {}).get("full_scan")]
+        if problems:
+            log.warning("%s %s: %s", request.method, request.path, "; ".join(problems))
+            with self._lock:
+                self._flagged.append({
+                    "at": time.strftime("%Y-%m-%d %H:%M:%S"),
+                    "method": request.method,
+                    "path": request.path,
+                    "endpoint": request.endpoint,
+                    "problems": problems,
+                    "statements": [{"sql": s[0], "ms": round(s[3] * 1000, 3), "rows": s[4]} for s in statements],
+                })
+        return response
+
+    def _explain(self, statement):
+        normalized, sql, params, seconds, rows = statement
+        with self._lock:
+            known = self._plans.get(normalized)
+            if known is not None:
+                known["max_ms"] = max(known["max_ms"], round(seconds * 1000, 3))
+                return
+        if params is None:  # executemany, nothing useful to explain
+            return
+        db = g.get("db")
+        if db is None:  # the view handed its connection back early (chat stream/poll)
+            return
+        try:
+            # Plain Connection.execute so the EXPLAIN itself isn't profiled
+            plan = [row[3] for row in sqlite3.Connection.execute(db, f"EXPLAIN QUERY PLAN {sql}", params)]
+            tables = {row[0] for row in sqlite3.Connection.execute(db, "SELECT name FROM sqlite_master WHERE type = 'table'")}
+        except sqlite3.Error as e:
+            plan, tables = [f"EXPLAIN failed: {e}"], set()
+        # "SCAN users" reads the whole table; "SCAN users USING INDEX ..." and scans of CTEs or
+        # subqueries ("SCAN page", "SCAN (subquery-2)") don't count
+        full_scan = any(step.startswith("SCAN ") and " USING " not in step and step.split()[1] in tables
+                        for step in plan)
+        with self._lock:
+            self._plans[normalized] = {"plan": plan, "full_scan": full_scan, "max_ms": round(seconds * 1000, 3)}
+
+    def report(self):
+        with self._lock:
+            return {
+                "budget": {"max_queries": self.max_queries, "max_ms": self.max_ms, "slow_ms": self.slow_ms,
+                           "repeat_limit": self.repeat_limit},
+                "flagged_requests": list(reversed(self._flagged)),
+                "slow_statements": [dict(v, sql=k) for k, v in
+                                    sorted(self._plans.items(), key=lambda kv: -kv[1]["max_ms"])],
+            }
@@ -0,0 +1,85 @@
+import random
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+# capacity = burst size, rate = tokens added back per second
+Policy = namedtuple("Policy", ["capacity", "rate"])
+
+# Single statement so concurrent processes can't both spend the last token: the update only
+# happens (rowcount == 1) when the refilled bucket still holds a whole token.
+TAKE_TOKEN_SQL = """
+    INSERT INTO rate_limits (key, tokens, updated_at) VALUES (:key, :capacity - 1, :now)
+    ON CONFLICT(key) DO UPDATE SET
+        tokens = min(:capacity, tokens + max(0, :now - updated_at) * :rate) - 1,
+        updated_at = :now
+    WHERE min(:capacity, tokens + max(0, :now - updated_at) * :rate) >= 1
+"""
+
+
+class RateLimiter:
+    # Token buckets per (policy, key). Each process keeps its own buckets as a fast path: a
+    # process only sees part of the traffic, so when its local bucket is empty the shared one
+    # is too and we can reject without touching SQLite. Otherwise the rate_limits table in
+    # users.db is the authority, so the limit holds across all mod_wsgi processes.
+
+    def __init__(self, policies, get_db=None, max_keys=10000, prune_after=3600):
+        self.policies = policies
+        self.get_db = get_db
+        self.max_keys = max_keys
+        self.prune_after = prune_after
+        self._buckets = OrderedDict()  # (policy, key) -> [tokens, updated_at]
+        self._lock = threading.Lock()
+
+    def hit(self, buckets):
+        # Spends one token from every (policy name, key) bucket, returns seconds to wait (0 means allowed)
+        now = time.time()
+        for policy_name, key in buckets:
+            wait = self._take_local(policy_name, self.policies[policy_name], key, now)
+            if wait:
+                return wait
+        if self.get_db is not None:
+            db = self.get_db()
+            # If users.db is write-locked by someone else, don't make every POST wait for (or fail
+            # on) the lock just to count it: the local bucket already let this one through
+            busy_timeout = db.execute("PRAGMA busy_timeout").fetchone()[0]
+            db.execute("PRAGMA busy_timeout = 0")
+            try:
+                return self._take_shared(db, buckets, now)
+            except sqlite3.OperationalError as e:
+                if "locked" not in str(e):
+                    raise
+                db.rollback()
+            finally:
+                db.execute(f"PRAGMA busy_timeout = {int(busy_timeout)}")
+        return 0
+
+    def _take_shared(self, db, buckets, now):
+        for policy_name, key in buckets:
+            policy = self.policies[policy_name]
+            cur = db.execute(TAKE_TOKEN_SQL, {"key": f"{policy_name}:{key}", "capacity": policy.capacity,
+                                              "rate": policy.rate, "now": now})
+            if cur.rowcount == 0:
+                db.commit()
+                return 1 / policy.rate
+        if random.random() < 0.01:
+            db.execute("DELETE FROM rate_limits WHERE updated_at < ?", (now - self.prune_after,))
+        db.commit()
+        return 0
+
+    def _take_local(self, policy_name, policy, key, now):
+        with self._lock:
+            bucket = self._buckets.get((policy_name, key))
+            if bucket is None:
+                bucket = self._buckets[(policy_name, key)] = [float(policy.capacity), now]
+                while len(self._buckets) > self.max_keys:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end((policy_name, key))
+                bucket[0] = min(policy.capacity, bucket[0] + (now - bucket[1]) * policy.rate)
+                bucket[1] = now
+            if bucket[0] < 1:
+                return (1 - bucket[0]) / policy.rate
+            bucket[0] -= 1
+            return 0
@@ -0,0 +1,51 @@
+# Periodic refresh of every registered player's snapshot. The web app only refreshes a snapshot
+# when a page shows it stale, so run this from cron, once for the whole site, e.g.
+#   */15 * * * * cd /srv/crc && python refresh_players.py --stale-only
+import argparse
+import os
+import time
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+from bulk_fetch import TokenBucket
+from cr_api import client_from_env
+from database import connect
+from snapshots import refresh_snapshots, stale_player_tags
+
+BASE_DIR = Path(__file__).parent
+DB_PATH = Path(os.getenv("DATABASE_PATH", BASE_DIR / "users.db"))
+
+
+def refresh_players(stale_only=False, max_age=600, workers=16, rate=20.0, burst=None):
+    load_dotenv(BASE_DIR / ".env")
+    client = client_from_env()
+    client.pool_size = max(client.pool_size, workers)
+    conn = connect(DB_PATH)
+    try:
+        if stale_only:
+            tags = stale_player_tags(conn, max_age)
+        else:
+            tags = [r[0] for r in conn.execute("SELECT player_tag FROM users")]
+        start = time.perf_counter()
+        errors = refresh_snapshots(conn, tags, client.get_player, workers, TokenBucket(rate, burst))
+        elapsed = time.perf_counter() - start
+    finally:
+        conn.close()
+        client.close()
+    print(f"Refreshed {len(tags) - len(errors)}/{len(tags)} players in {elapsed:.1f}s")
+    for tag, error in sorted(errors.items()):
+        print(f"  #{tag}: {error}")
+    return errors
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Refresh player snapshots for every registered user")
+    parser.add_argument("--stale-only", action="store_true", help="only players whose snapshot is older than --max-age")
+    parser.add_argument("--max-age", type=int, default=600, help="seconds before a snapshot counts as stale")
+    parser.add_argument("--workers", type=int, default=16, help="concurrent API requests")
+    parser.add_argument("--rate", type=float, default=float(os.getenv("CR_API_RATE", "20")), help="API requests per second")
+    parser.add_argument("--burst", type=int, default=None, help="requests allowed in a burst (defaults to --rate)")
+    args = parser.parse_args()
+    errors = refresh_players(args.stale_only, args.max_age, args.workers, args.rate, args.burst)
+    raise SystemExit(1 if errors else 0)
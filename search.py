@@ -0,0 +1,96 @@
+import re
+
+from markupsafe import Markup, escape
+
+# Full text search over the FTS5 indexes from migration 9. Each index is an external content
+# table kept in step by triggers, so a search reads the matching rowids (ranked by bm25) out of
+# the index and joins back to the rows by primary key, instead of LIKE-scanning whole tables.
+
+TERM = re.compile(r"\w+")
+MAX_TERMS = 8
+# snippet() wraps each hit in these; highlight() escapes the text and turns them into <mark>
+HIT_START, HIT_END = "\x02", "\x03"
+# bm25 has to score every match before it can sort, and a common word can match most of the
+# chat history. Only the newest WINDOW matches are ranked (found by rowid, which is cheap), so
+# a search costs the same however long the history gets.
+WINDOW = 1000
+
+SCOPES = {
+    "announcements": """
+        SELECT announcements.id,
+               announcements.created_at,
+               snippet(announcements_fts, 0, :hit_start, :hit_end, '…', 24) AS snippet,
+               users.username,
+               users.cr_username,
+               users.pfp,
+               users.rarity
+        FROM announcements_fts
+        JOIN announcements ON announcements.id = announcements_fts.rowid
+        JOIN users ON users.id = announcements.user_id
+        WHERE announcements_fts MATCH :query
+          AND announcements_fts.rowid >= coalesce((
+              SELECT rowid FROM announcements_fts WHERE announcements_fts MATCH :query
+              ORDER BY rowid DESC LIMIT 1 OFFSET :window - 1), 0)
+        ORDER BY announcements_fts.rank
+        LIMIT :limit OFFSET :offset
+    """,
+    "chat": """
+        SELECT chat_messages.id,
+               chat_messages.created_at,
+               snippet(chat_messages_fts, 0, :hit_start, :hit_end, '…', 24) AS snippet,
+               users.username,
+               users.cr_username,
+               users.pfp,
+               users.rarity
+        FROM chat_messages_fts
+        JOIN chat_messages ON chat_messages.id = chat_messages_fts.rowid
+        JOIN users ON users.id = chat_messages.user_id
+        WHERE chat_messages_fts MATCH :query
+          AND chat_messages_fts.rowid >= coalesce((
+              SELECT rowid FROM chat_messages_fts WHERE chat_messages_fts MATCH :query
+              ORDER BY rowid DESC LIMIT 1 OFFSET :window - 1), 0)
+        ORDER BY chat_messages_fts.rank
+        LIMIT :limit OFFSET :offset
+    """,
+    # The exact username first, then a username hit outranks a Clash Royale name hit, which
+    # outranks a tag hit
+    "members": """
+        SELECT users.username,
+               users.cr_username,
+               users.player_tag,
+               users.pfp,
+               users.rarity,
+               users.points
+        FROM users_fts
+        JOIN users ON users.id = users_fts.rowid
+        WHERE users_fts MATCH :query
+        ORDER BY users.username = :exact COLLATE NOCASE DESC, bm25(users_fts, 3.0, 2.0, 1.0), users.points DESC
+        LIMIT :limit OFFSET :offset
+    """,
+}
+
+
+def match_query(text, prefix=False):
+    # User input -> FTS5 query where every word has to appear. Words are quoted, so FTS5
+    # syntax in the input (AND, NEAR, quotes, "-", ":") is just text and can't raise. With
+    # prefix=True the last word may be unfinished ("hog ri" finds "hog rider"). None if no words.
+    terms = TERM.findall(text)[:MAX_TERMS]
+    if not terms:
+        return None
+    quoted = [f'"{term}"' for term in terms]
+    if prefix:
+        quoted[-1] += "*"
+    return " ".join(quoted)
+
+
+def search(db, scope, text, limit=20, offset=0, prefix=False):
+    query = match_query(text, prefix)
+    if query is None:
+        return []
+    return db.execute(SCOPES[scope], {"query": query, "limit": limit, "offset": offset, "window": WINDOW,
+                                      "exact": text.strip(), "hit_start": HIT_START, "hit_end": HIT_END}).fetchall()
+
+
+def highlight(snippet):
+    # Jinja filter: the snippet is user text, so escape it first and only then add the marks
+    return Markup(str(escape(snippet)).replace(HIT_START, "<mark>").replace(HIT_END, "</mark>"))
@@ -0,0 +1,124 @@
+import argparse
+import json
+import random
+import time
+from pathlib import Path
+
+from werkzeug.security import generate_password_hash
+
+from bracket import generate_bracket, report_result
+from database import connect
+from fake_cr_api import fake_player
+from init_db import init_db
+from snapshots import SAVE_SNAPSHOT_SQL
+
+PFP_DIR = Path(__file__).parent / "static" / "pfp"
+RARITIES = ["common"] * 6 + ["rare"] * 3 + ["epic"] * 2 + ["legendary"]
+# Every seeded account logs in with this, handy when poking at a seeded copy by hand
+SEED_PASSWORD = "password1"
+
+WORDS = ("club meeting tonight bring your decks ladder push anyone want to 2v2 tournament "
+         "bracket is up good games gg evo knight cycle hog rider log balanced elixir").split()
+
+
+def sentence(rng, low=4, high=16):
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(low, high))).capitalize() + "."
+
+
+def timestamps(rng, count, days):
+    # `count` ascending "YYYY-MM-DD HH:MM:SS" values spread over the last `days` days
+    now = time.time()
+    stamps = sorted(now - rng.random() * days * 86400 for _ in range(count))
+    return [time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(t)) for t in stamps]
+
+
+def seed(db_path, users=500, announcements=200, messages=5000, tournaments=10, players=16,
+         results=0.5, snapshots=0.9, rng_seed=1):
+    # Fills a database (created if missing) with a reproducible club: users with snapshots for
+    # a `snapshots` fraction of them (the rest hit the API on first view), announcements, chat
+    # history and tournaments of `players` entrants each with `results` of their first round
+    # played. Player tags are B000000, B000001, ... and every password is SEED_PASSWORD.
+    # Refuses a database that already has users, so it can't fill the live one with fake
+    # accounts (two of them admins) that anyone can log in to.
+    rng = random.Random(rng_seed)
+    init_db(db_path)
+    pfps = sorted(f.stem for f in PFP_DIR.glob("*.webp")) or ["Knight"]
+    conn = connect(db_path)
+    try:
+        if conn.execute("SELECT 1 FROM users LIMIT 1").fetchone():
+            raise ValueError(f"{db_path} already has users, seed a new database instead")
+        password_hash = generate_password_hash(SEED_PASSWORD)
+        tags = [f"B{i:06d}" for i in range(users)]
+        conn.executemany(
+            "INSERT INTO users (username, email, password_hash, cr_username, player_tag, pfp, rarity, points, is_admin) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [(f"player{i}", f"player{i}@example.com", password_hash, f"Player {i}", tag, rng.choice(pfps),
+              rng.choice(RARITIES), int(rng.paretovariate(1.5) * 10) - 10, int(i < 2))
+             for i, tag in enumerate(tags)],
+        )
+        user_ids = [row[0] for row in conn.execute("SELECT id FROM users WHERE player_tag LIKE 'B%' ORDER BY id")]
+        now = time.time()
+        conn.executemany(SAVE_SNAPSHOT_SQL, [(tag, json.dumps(fake_player(tag)), now)
+                                             for tag in tags if rng.random() < snapshots])
+        admins = user_ids[:2] or user_ids
+        conn.executemany(
+            "INSERT INTO announcements (user_id, announcement, created_at) VALUES (?, ?, ?)",
+            [(rng.choice(admins), sentence(rng, 10, 40), stamp) for stamp in timestamps(rng, announcements, 180)],
+        )
+        conn.executemany(
+            "INSERT INTO chat_messages (user_id, message, created_at) VALUES (?, ?, ?)",
+            [(rng.choice(user_ids), sentence(rng), stamp) for stamp in timestamps(rng, messages, 30)],
+        )
+        # participants.name is unique, so each user enters at most one tournament
+        entrants = list(zip(user_ids, (f"player{i}" for i in range(users))))
+        rng.shuffle(entrants)
+        for t in range(tournaments):
+            cur = conn.execute(
+                "INSERT INTO tournaments (name, description, date, location) VALUES (?, ?, ?, ?)",
+                (f"Club Cup {t + 1}", sentence(rng), time.strftime("%Y-%m-%d %H:%M", time.gmtime(now + t * 7 * 86400)),
+                 "Room 140"),
+            )
+            tid = cur.lastrowid
+            field, entrants = entrants[:players], entrants[players:]
+            conn.executemany(
+                "INSERT INTO participants (tournament_id, name, user_id, seed) VALUES (?, ?, ?, ?)",
+                [(tid, name, uid, seed if seed <= 4 else None) for seed, (uid, name) in enumerate(field, 1)],
+            )
+            participants = conn.execute("SELECT id, name, seed FROM participants WHERE tournament_id = ?", (tid,)).fetchall()
+            if len(participants) < 2:
+                continue
+            generate_bracket(conn, tid, [tuple(p) for p in participants])
+            first_round = conn.execute(
+                "SELECT id FROM matches WHERE tournament_id = ? AND round = 1 AND player1_id IS NOT NULL "
+                "AND player2_id IS NOT NULL AND winner_id IS NULL",
+                (tid,),
+            ).fetchall()
+            for (match_id,) in first_round:
+                if rng.random() < results:
+                    report_result(conn, tid, match_id, *rng.choice([(3, 1), (1, 3), (2, 0), (0, 2)]))
+        conn.commit()
+        conn.execute("ANALYZE")
+    finally:
+        conn.close()
+    return tags
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Seed a database with a reproducible fake club for benchmarks")
+    parser.add_argument("--db", type=Path, required=True, help="new database file to create (never the live users.db)")
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--announcements", type=int, default=200)
+    parser.add_argument("--messages", type=int, default=5000, help="chat messages")
+    parser.add_argument("--tournaments", type=int, default=10)
+    parser.add_argument("--players", type=int, default=16, help="entrants per tournament")
+    parser.add_argument("--results", type=float, default=0.5, help="fraction of first round matches played")
+    parser.add_argument("--snapshots", type=float, default=0.9, help="fraction of users with a stored API snapshot")
+    parser.add_argument("--seed", type=int, default=1, help="random seed")
+    args = parser.parse_args()
+    start = time.perf_counter()
+    try:
+        seed(args.db, args.users, args.announcements, args.messages, args.tournaments, args.players,
+             args.results, args.snapshots, args.seed)
+    except ValueError as e:
+        parser.error(str(e))
+    print(f"Seeded {args.db} in {time.perf_counter() - start:.1f}s")
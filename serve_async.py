@@ -0,0 +1,54 @@
+# Cooperative serving mode: one process, gevent greenlets instead of mod_wsgi threads.
+# monkey.patch_all() makes sockets, sleeps, locks and threads cooperative, so while home() or
+# profile() waits on the Clash Royale API the same worker keeps serving other requests, and
+# hundreds of upstream calls can be in flight at once. It has to run before anything else is
+# imported. Routes are unchanged: requests, the caches and the SSE chat stream all just yield.
+# SQLite is the exception: its calls never yield, and a write waiting on the lock (held by
+# worker.py, refresh_players.py or another process) stalls every greenlet for as long as it
+# waits. So the busy timeout here is short, and a write that can't get the lock in time fails
+# with "database is locked" (answered 503 with Retry-After) instead of freezing the server.
+from gevent import monkey
+
+monkey.patch_all()
+
+import argparse
+import os
+
+from gevent.pool import Pool
+from gevent.pywsgi import WSGIServer
+from gevent.threadpool import ThreadPoolExecutor
+
+from passwords import PasswordService
+
+
+def serve(host="0.0.0.0", port=8000, concurrency=200):
+    # Enough keep-alive API connections for every request that might be waiting upstream
+    os.environ.setdefault("CR_API_POOL_SIZE", str(concurrency))
+    os.environ.setdefault("DB_BUSY_TIMEOUT_MS", "200")
+    # A chat stream waiting here is a parked greenlet, not a thread, so far more can stay open
+    os.environ.setdefault("CHAT_MAX_STREAMS", str(concurrency // 2))
+    os.environ.setdefault("CHAT_STREAM_SECONDS", "300")
+    import app as site
+
+    # The password process pool's helper threads would be greenlets here and it deadlocks.
+    # hashlib's scrypt/pbkdf2 release the GIL, so gevent's real OS threads overlap them as well.
+    if site.passwords.workers > 0:
+        site.passwords.close()
+        site.passwords = PasswordService(
+            site.passwords.method, site.passwords.workers, site.passwords.max_pending, site.passwords.timeout,
+            executor=ThreadPoolExecutor(site.passwords.workers),
+        )
+
+    server = WSGIServer((host, port), site.app, spawn=Pool(concurrency), log=None)
+    print(f"Serving on http://{host}:{server.server_port} ({concurrency} concurrent requests)", flush=True)
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the app with gevent so requests waiting on the API don't block a worker")
+    parser.add_argument("--host", default=os.getenv("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8000")))
+    parser.add_argument("--concurrency", type=int, default=int(os.getenv("ASYNC_CONCURRENCY", "200")),
+                        help="requests handled at once")
+    args = parser.parse_args()
+    serve(args.host, args.port, args.concurrency)
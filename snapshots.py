@@ -0,0 +1,130 @@
+import json
+import logging
+import queue
+import sqlite3
+import threading
+import time
+
+import requests
+
+from bulk_fetch import iter_fetch
+from database import connect
+
+log = logging.getLogger(__name__)
+
+
+def get_snapshot(db, player_tag):
+    # Returns (data, fetched_at) for the stored player JSON, or None if we never fetched it
+    row = db.execute(
+        "SELECT data, fetched_at FROM player_snapshots WHERE player_tag = ?", (player_tag,)
+    ).fetchone()
+    if row is None:
+        return None
+    return json.loads(row[0]), row[1]
+
+
+SAVE_SNAPSHOT_SQL = (
+    "INSERT INTO player_snapshots (player_tag, data, fetched_at) VALUES (?, ?, ?) "
+    "ON CONFLICT(player_tag) DO UPDATE SET data = excluded.data, fetched_at = excluded.fetched_at"
+)
+
+
+def save_snapshot(db, player_tag, data, fetched_at=None):
+    db.execute(SAVE_SNAPSHOT_SQL, (player_tag, json.dumps(data), fetched_at or time.time()))
+
+
+def refresh_snapshots(db, tags, fetch, workers=8, limiter=None, batch_size=100, on_update=None):
+    # Concurrent bulk refresh, written back in executemany batches as results arrive.
+    # Returns {tag: error} for the tags that failed; their old snapshots are left alone.
+    errors = {}
+    batch = []
+    for tag, data, error in iter_fetch(tags, fetch, workers, limiter):
+        if error is not None:
+            errors[tag] = error
+            continue
+        batch.append((tag, json.dumps(data), time.time()))
+        if on_update is not None:
+            on_update(tag, data)
+        if len(batch) >= batch_size:
+            db.executemany(SAVE_SNAPSHOT_SQL, batch)
+            db.commit()
+            batch = []
+    if batch:
+        db.executemany(SAVE_SNAPSHOT_SQL, batch)
+        db.commit()
+    return errors
+
+
+def stale_player_tags(db, max_age):
+    # Registered players whose snapshot is missing or older than max_age seconds
+    rows = db.execute("""
+        SELECT users.player_tag
+        FROM users
+        LEFT JOIN player_snapshots ON player_snapshots.player_tag = users.player_tag
+        WHERE player_snapshots.fetched_at IS NULL OR player_snapshots.fetched_at < ?
+    """, (time.time() - max_age,)).fetchall()
+    return [r[0] for r in rows]
+
+
+class SnapshotRefresher:
+    # Background thread serving refreshes requested by page views (request_refresh) so those
+    # never block a request, and storing data a view already fetched (request_save) so a GET
+    # never takes the write lock. The periodic sweep of every stale player isn't done here: each
+    # web process would run its own, multiplying API calls and writes by the process count.
+    # Run `refresh_players.py --stale-only` from cron instead.
+
+    def __init__(self, database, fetch, max_age=600, on_update=None):
+        self.database = database
+        self.fetch = fetch
+        self.max_age = max_age
+        self.on_update = on_update
+        self._queue = queue.Queue()
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="snapshot-refresher", daemon=True)
+                self._thread.start()
+
+    def request_refresh(self, player_tag):
+        with self._lock:
+            if player_tag in self._pending:
+                return
+            self._pending.add(player_tag)
+        self._queue.put((player_tag, None))
+        self.start()
+
+    def request_save(self, player_tag, data):
+        self._queue.put((player_tag, data))
+        self.start()
+
+    def refresh(self, db, player_tag, data=None):
+        if data is None:
+            try:
+                data = self.fetch(player_tag)
+            except requests.RequestException:
+                return None
+        save_snapshot(db, player_tag, data)
+        db.commit()
+        if self.on_update is not None:
+            self.on_update(player_tag, data)
+        return data
+
+    def _run(self):
+        db = connect(self.database)
+        try:
+            while True:
+                player_tag, data = self._queue.get()
+                if data is None:
+                    with self._lock:
+                        self._pending.discard(player_tag)
+                try:
+                    self.refresh(db, player_tag, data)
+                except sqlite3.Error:
+                    db.rollback()
+                    log.exception("Error refreshing player snapshot %s", player_tag)
+        finally:
+            db.close()
@@ -0,0 +1,86 @@
+import hashlib
+import json
+import mimetypes
+from pathlib import Path
+
+from flask import request, send_from_directory, url_for
+
+# Hashed files never change, so browsers can keep them for a year without revalidating
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+
+class StaticAssets:
+    # Serves the output of build_assets.py. url_for("static", filename="style.css") resolves to
+    # the fingerprinted copy when static/dist/manifest.json exists and to the original file
+    # otherwise, so a checkout that was never built still works.
+
+    def __init__(self, app=None, manifest_path=None):
+        self.manifest_path = manifest_path
+        self.files = {}
+        self.images = {}
+        self.encodings = {}
+        self.pfp_sprite = {}
+        self.version = None  # changes with every build, None when never built
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        if self.manifest_path is None:
+            self.manifest_path = Path(app.static_folder) / "dist" / "manifest.json"
+        self.static_folder = app.static_folder
+        self.load()
+        app.url_defaults(self.hashed_filename)
+        app.view_functions["static"] = self.send_static
+        app.jinja_env.globals["static_image"] = self.image
+
+    def load(self):
+        try:
+            text = Path(self.manifest_path).read_text()
+        except FileNotFoundError:
+            text = "{}"
+        manifest = json.loads(text)
+        self.version = hashlib.sha1(text.encode()).hexdigest()[:10] if manifest else None
+        self.files = manifest.get("files", {})
+        self.images = manifest.get("images", {})
+        self.encodings = manifest.get("encodings", {})
+        self.pfp_sprite = manifest.get("pfp_sprite", {})
+
+    def hashed_filename(self, endpoint, values):
+        if endpoint == "static" and values.get("filename") in self.files:
+            values["filename"] = self.files[values["filename"]]
+
+    def image(self, filename, width):
+        # <picture> data for an image shown `width` CSS px wide: src is the resized original
+        # format, sources are (mime, srcset) pairs for the better formats that were built
+        sources = self.images.get(filename, {}).get(str(width))
+        if not sources:
+            return {"src": url_for("static", filename=filename), "sources": []}
+        *better, (_, src, src_2x) = sources
+        return {
+            "src": url_for("static", filename=src),
+            "srcset": f"{url_for('static', filename=src)} 1x, {url_for('static', filename=src_2x)} 2x",
+            "sources": [
+                (mime, f"{url_for('static', filename=x1)} 1x, {url_for('static', filename=x2)} 2x")
+                for mime, x1, x2 in better
+            ],
+        }
+
+    def send_static(self, filename):
+        if not filename.startswith("dist/"):
+            return send_from_directory(self.static_folder, filename)
+        response = None
+        for encoding in self.encodings.get(filename, ()):
+            if encoding in request.accept_encodings:
+                suffix = ".br" if encoding == "br" else ".gz"
+                response = send_from_directory(
+                    self.static_folder, filename + suffix,
+                    mimetype=mimetypes.guess_type(filename)[0], max_age=IMMUTABLE_MAX_AGE,
+                )
+                response.headers["Content-Encoding"] = encoding
+                break
+        if response is None:
+            response = send_from_directory(self.static_folder, filename, max_age=IMMUTABLE_MAX_AGE)
+        if filename in self.encodings:
+            response.vary.add("Accept-Encoding")
+        response.cache_control.immutable = True
+        return response
@@ -0,0 +1,63 @@
+# Background job worker: runs the jobs that routes enqueue (see jobs.py). Run one or more
+# alongside the web server, e.g. `python worker.py` under systemd; claims are atomic, so any
+# number of worker processes can share the queue. SIGTERM/SIGINT finish the current jobs first.
+import argparse
+import logging
+import os
+import signal
+import smtplib
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+from data_versions import bump
+from jobs import PermanentJobError, Worker
+from mailer import mailer_from_env
+
+BASE_DIR = Path(__file__).parent
+load_dotenv(BASE_DIR / ".env")
+DATABASE = Path(os.getenv("DATABASE_PATH", BASE_DIR / "users.db"))
+
+# Most of each kind running at once across every worker process
+DEFAULT_LIMITS = "send_email=2,purge_user=1"
+
+
+def parse_limits(text):
+    return {kind.strip(): int(n) for kind, n in (item.split("=") for item in text.split(",") if item.strip())}
+
+
+def make_handlers(mailer):
+    def send_email(db, payload):
+        try:
+            mailer.send(payload["to"], payload["subject"], payload["body"])
+        except (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused) as e:
+            raise PermanentJobError(f"rejected by the mail server: {e}") from e
+
+    def purge_user(db, payload):
+        # Rows a deleted account leaves behind that no page shows any more
+        deleted = db.execute("DELETE FROM announcements WHERE user_id = ?", (payload["user_id"],)).rowcount
+        db.execute("""
+            DELETE FROM player_snapshots
+            WHERE player_tag = :tag AND NOT EXISTS (SELECT 1 FROM users WHERE player_tag = :tag)
+        """, {"tag": payload["player_tag"]})
+        if deleted:
+            bump(db, "announcements")
+
+    return {"send_email": send_email, "purge_user": purge_user}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run background jobs from the queue in users.db")
+    parser.add_argument("--concurrency", type=int, default=int(os.getenv("WORKER_CONCURRENCY", "4")),
+                        help="jobs run at once by this process")
+    parser.add_argument("--limits", type=parse_limits, default=parse_limits(os.getenv("JOB_LIMITS", DEFAULT_LIMITS)),
+                        help="per-kind caps across all workers, e.g. send_email=2,purge_user=1")
+    parser.add_argument("--lease", type=float, default=float(os.getenv("JOB_LEASE", "300")),
+                        help="seconds before a job whose worker went away is run again")
+    parser.add_argument("--drain", action="store_true", help="exit once no job is due instead of waiting for more")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    worker = Worker(DATABASE, make_handlers(mailer_from_env()), args.concurrency, args.limits, args.lease)
+    signal.signal(signal.SIGTERM, lambda *_: worker.stop())
+    signal.signal(signal.SIGINT, lambda *_: worker.stop())
+    worker.run(drain=args.drain)